@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Table, Integer, DateTime, MetaData
+from sqlalchemy import Column, String, Table, Integer, DateTime, MetaData, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -18,6 +18,41 @@ class ClaveProdServ(Base):
     Combined = Column(String)
 
 
+class ClaveProdServHistory(Base):
+    # Una fila por cada contenido distinto de una clave a lo largo de las versiones del catálogo;
+    # valid_from/valid_to (YYYYMMDD) es el intervalo en que esa fila era la vigente
+    __tablename__ = "clave_prod_serv_history"
+    __table_args__ = (
+        Index("ix_clave_prod_serv_history_validity", "c_ClaveProdServ", "valid_from", "valid_to"),
+    )
+    id = Column(Integer, primary_key=True)
+    c_ClaveProdServ = Column(String)
+    Descripcion = Column(String)
+    Incluir_IVA_trasladado = Column(String)
+    Incluir_IEPS_trasladado = Column(String)
+    Complemento_que_debe_incluir = Column(String)
+    FechaInicioVigencia = Column(DateTime)
+    FechaFinVigencia = Column(DateTime)
+    Estimulo_Franja_Fronteriza = Column(String)
+    Palabras_similares = Column(String)
+    Combined = Column(String)
+    row_hash = Column(String)
+    valid_from = Column(Integer)
+    valid_to = Column(Integer)
+    first_version = Column(String)
+    last_version = Column(String, index=True)
+
+
+class CatalogHistoryVersion(Base):
+    __tablename__ = "catalog_history_versions"
+    version = Column(String, primary_key=True)
+    applied_at = Column(DateTime)
+    rows = Column(Integer)
+    added = Column(Integer)
+    changed = Column(Integer)
+    removed = Column(Integer)
+
+
 class Classification(Base):
     __tablename__ = "classification"
     tipo_num = Column(Integer)
@@ -28,3 +63,19 @@ class Classification(Base):
     Grupo = Column(String)
     Clase_num = Column(Integer, primary_key=True)
     Clase = Column(String)
+
+
+class ClaveProdServSearch(Base):
+    __tablename__ = "clave_prod_serv_search"
+    clave_num = Column(Integer, primary_key=True)
+    c_ClaveProdServ = Column(String)
+    Descripcion = Column(String)
+    Palabras_similares = Column(String)
+    tipo_num = Column(Integer)
+    Tipo = Column(String)
+    Div_num = Column(Integer)
+    Division = Column(String)
+    Grupo_num = Column(Integer)
+    Grupo = Column(String)
+    Clase_num = Column(Integer, index=True)
+    Clase = Column(String)
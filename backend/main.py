@@ -1,28 +1,47 @@
-from fastapi import FastAPI, status, Depends, Query
+from fastapi import FastAPI, status, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
 from sqlalchemy import or_
 from sqlalchemy import func
 
 from sqlalchemy.orm import Session
 from sqlalchemy import cast, Integer, text
 
-from datetime import datetime
+from datetime import date, datetime
+from typing import List, Literal, Optional, Union
 import json
 import os
 import aiofiles
+import asyncio
 import threading
 import logging
+import time
 
 from src.generator import pull_json
 from src.generator import is_pull_locked
-from src.catalogo_pull import download_cfdi_catalog
-from db import Base, ClaveProdServ, Classification
+from src.catalogo_pull import download_cfdi_catalog, discover_latest_catalog, CATALOG_DIR
+from src.catalog_versions import load_versions, latest_version
+from db import ClaveProdServ, Classification
 from sqlalchemy import Table, MetaData
 
-from session import get_db, engine, SessionLocal
-from src.taxonomy import load_flatten_data
-from src.catalogo_pull import load_latest_catalog_to_db
+from session import open_snapshot, with_db, active_snapshot
+from src.taxonomy import get_taxonomy_index
+from src.search import search_rows, tokenize_query, SEARCH_COLUMNS
+from src.responses import FastJSONResponse, dumps, records, columnar
+from src.result_cache import search_cache
+from src.metrics import HTTP_REQUEST_DURATION, mark_process_dead, render_metrics
+from prometheus_client import CONTENT_TYPE_LATEST
+from src.autocomplete import autocomplete, get_spelling_index
+from src.lookup import lookup_codes, lookup_queries, LOOKUP_CHUNK
+from src.catalog_history import history_versions
+from src.catalog_engine import CATALOG_ENGINE, get_catalog_engine, search_rows_in_memory
+from src.snapshot import build_snapshot, current_snapshot, ensure_snapshot, prune_snapshots, snapshot_catalog_date
+from src.http_cache import cached_file_response, conditional_response, file_timestamp
+from src.executors import run_db, run_io, run_cpu, cancel_event
+from src.executors import shutdown as shutdown_executors
+from src.jobs import jobs, JobFailed
+from src.file_lock import LockBusy
 
 logging.basicConfig(
     level=logging.INFO,
@@ -31,9 +50,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-Base.metadata.create_all(bind=engine)
+SNAPSHOT_POLL_SECONDS = 10
+MAX_BATCH_CODES = 50000
+MAX_BATCH_QUERIES = 5000
+# Búsquedas de texto por tarea del pool al responder en NDJSON
+QUERY_CHUNK = 50
+
 metadata = MetaData()
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,12 +67,60 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # Plantilla de la ruta (/jobs/{job_id}) para no crear una serie por cada valor
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.labels(
+            method=request.method,
+            path=route.path if route is not None else "unmatched",
+            status=status_code,
+        ).observe(time.perf_counter() - start)
+
+
+async def serve_snapshot(path):
+    await run_io(open_snapshot, path)
+    search_cache.clear()
+    # El índice de corrección se arma antes de la primera consulta, no durante ella
+    await run_db(get_spelling_index)
+    if CATALOG_ENGINE == "memory":
+        await memory_engine()
+
+
+async def memory_engine():
+    """Motor en memoria del snapshot activo (CATALOG_ENGINE=memory); se construye una vez por snapshot."""
+    return await run_db(get_catalog_engine, snapshot_catalog_date(active_snapshot()))
+
+
+async def follow_current_snapshot():
+    # Otros workers pueden publicar un snapshot nuevo; cambiarse a él sin reiniciar
+    while True:
+        await asyncio.sleep(SNAPSHOT_POLL_SECONDS)
+        try:
+            path = await run_io(current_snapshot)
+            if path and path != active_snapshot() and not jobs.active("load_db"):
+                await serve_snapshot(path)
+        except Exception as e:
+            logger.error(f"Failed to follow current snapshot: {e}")
+
+
 @app.on_event("startup")
 async def startup_event():
-    with SessionLocal() as db:
-        db.query(Classification).delete()
-        load_flatten_data()
-        load_latest_catalog_to_db()
+    await serve_snapshot(current_snapshot() or await run_cpu(ensure_snapshot))
+    asyncio.get_running_loop().create_task(follow_current_snapshot())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    shutdown_executors()
+    mark_process_dead()
 
 
 @app.get("/")
@@ -64,19 +136,57 @@ async def health():
     return JSONResponse(status_code=status.HTTP_200_OK, content={"status": "healthy"})
 
 
+def job_response(job, created):
+    if created:
+        return JSONResponse(status_code=202, content={"message": f"{job.type} started", "job": job.to_dict()})
+    return JSONResponse(status_code=200, content={"message": f"{job.type} already running", "job": job.to_dict()})
+
+
+async def pull_taxonomy_job(job, forced=False):
+    with job.phase("crawl"):
+        try:
+            await run_io(pull_json, forced, progress=job.increment)
+        except LockBusy:
+            raise JobFailed("pull_taxonomy is already running in another worker")
+    return {"output_file": "output.json"}
+
+
 @app.get("/pull_taxonomy")
-async def pull_json_endpoint():
-    current_time = datetime.now().isoformat()
+async def pull_json_endpoint(forced: bool = False):
     logger.info("Pull JSON endpoint accessed")
     is_locked = is_pull_locked()
-    if is_locked["locked"]:
+    if is_locked["locked"] and not forced:
         return {
             "Message": "Can't trigger a new pull rightnow",
             "reason": is_locked["reason"],
         }
-    pull_json_thread = threading.Thread(target=pull_json)
-    pull_json_thread.start()
-    return {"message": "JSON pulled triggered", "timestamp": current_time}
+    return job_response(*jobs.submit("pull_taxonomy", pull_taxonomy_job, forced=forced))
+
+
+@app.get("/jobs")
+async def list_jobs():
+    return [job.to_dict() for job in jobs.list()]
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job.to_dict()
+
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    job = jobs.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Job not found"})
+    return job.to_dict()
+
+
+@app.get("/metrics")
+async def metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
 
 
 @app.get("/favicon.ico")
@@ -85,16 +195,15 @@ async def favicon():
 
 
 @app.get("/show_latest")
-async def show_latest():
+async def show_latest(request: Request):
     file_path = "/app/output.json"
     try:
-        if not os.path.exists(file_path):
-            return JSONResponse(status_code=404, content={"error": "File not found"})
-        async with aiofiles.open(file_path, "r", encoding="utf-8") as f:
-            content = await f.read()
-        data = json.loads(content)
-        created = datetime.fromtimestamp(os.path.getmtime(file_path)).isoformat()
-        return {"date_pulled": created, "data": data}
+        entry = await run_io(
+            cached_file_response, file_path, lambda data, mtime: {"date_pulled": file_timestamp(mtime), "data": data}
+        )
+        return conditional_response(request, entry)
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"error": "File not found"})
     except json.JSONDecodeError as e:
         return JSONResponse(
             status_code=400, content={"error": f"Invalid JSON: {str(e)}"}
@@ -103,103 +212,186 @@ async def show_latest():
         return JSONResponse(status_code=500, content={"error": str(e)})
 
 
+@app.get("/taxonomy")
+@app.get("/taxonomy/{node_path:path}")
+async def taxonomy(
+    node_path: str = "",
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    format: Literal["records", "columnar"] = "records",
+):
+    try:
+        index = await run_io(get_taxonomy_index, "/app/output.json")
+    except FileNotFoundError:
+        return JSONResponse(status_code=404, content={"error": "File not found"})
+    path = tuple(part for part in node_path.split("/") if part)
+    node = index.children(path, limit, offset, columnar=format == "columnar")
+    if node is None:
+        return JSONResponse(status_code=404, content={"error": f"Node not found: {node_path}"})
+    return FastJSONResponse(node)
+
+
+async def pull_catalogo_job(job, date_str):
+    if date_str == "latest":
+        # Probar fechas posteriores a la última descargada en lugar de pedir la fecha exacta
+        with job.phase("discover"):
+            found = await run_io(discover_latest_catalog)
+        if found is None:
+            return {"message": "already up to date", "version": await run_io(latest_version, CATALOG_DIR)}
+        date_str = found
+    with job.phase("download"):
+        catalog = await run_io(download_cfdi_catalog, date_str, progress=job.increment)
+    if not catalog["success"] and catalog["reason"] == "Not a valid date":
+        raise JobFailed("Date not found on SAT")
+    if not catalog["success"]:
+        raise JobFailed(str(catalog["reason"]))
+    return {
+        "message": catalog["reason"],
+        "version": date_str,
+        "bytes": catalog.get("bytes"),
+        "resumed_from": catalog.get("resumed_from"),
+    }
+
+
 @app.post("/pull_catalogo/{date_str}")
 async def pull_catalogo(date_str: str):
-    catalog = download_cfdi_catalog(date_str)
-    if catalog["success"]:
-        return JSONResponse(status_code=200, content={"message": catalog["reason"]})
-    if not catalog["success"] and catalog["reason"] == "Not a valid date":
-        return JSONResponse(status_code=404, content={"error": "Date not found on SAT"})
+    return job_response(*jobs.submit("pull_catalogo", pull_catalogo_job, date_str=date_str))
 
-    return JSONResponse(status_code=500, content={"error": "server error"})
 
+@app.get("/catalog_versions")
+async def catalog_versions():
+    versions = await run_io(load_versions, CATALOG_DIR)
+    ordered = sorted(versions.values(), key=lambda v: v["date"], reverse=True)
+    return {"latest": ordered[0]["date"] if ordered else None, "versions": ordered}
 
-@app.get("/load_db")
-async def load_db(db: Session = Depends(get_db)):
-    db.query(Classification).delete()
-    load_flatten_data()
-    load_latest_catalog_to_db()
+
+@with_db
+def catalog_counts(*, db):
     classification_count = db.query(Classification).count()
     clave_prod_serv_count = db.query(ClaveProdServ).count()
     return {"classification_count": classification_count, "clave_prod_serv_count": clave_prod_serv_count}
 
 
+async def load_db_job(job, diff=False, version="latest"):
+    # El catálogo nuevo se construye en otro archivo mientras se sigue atendiendo el actual
+    with job.phase("build_snapshot"):
+        # El build corre en otro proceso: la cancelación le llega por un Event compartido
+        cancel = await run_io(cancel_event)
+        job.on_cancel(cancel.set)
+        try:
+            path = await run_cpu(build_snapshot, diff=diff, version=version, cancel=cancel)
+        except LockBusy:
+            raise JobFailed("A snapshot is already being built in another worker")
+    # build_snapshot ya publicó current.json y los demás workers lo siguen: no hay vuelta atrás
+    job.point_of_no_return()
+    with job.phase("swap"):
+        previous = active_snapshot()
+        await serve_snapshot(path)
+        await run_io(prune_snapshots, [path, previous])
+    with job.phase("count_rows"):
+        counts = await run_db(catalog_counts)
+    job.report(**counts)
+    return {"snapshot": path, **counts}
+
+
+@app.get("/load_db")
+async def load_db(diff: bool = False, version: str = "latest"):
+    return job_response(*jobs.submit("load_db", load_db_job, diff=diff, version=version))
+
+
+async def history_missing(as_of):
+    # Los snapshots construidos antes del historial no pueden responder consultas con as_of
+    if as_of is None or await run_db(history_versions):
+        return None
+    return JSONResponse(
+        status_code=409, content={"error": "Catalog history not loaded, run /load_db to build it"}
+    )
+
+
 @app.get("/search_clave_prod_and_taxonomy")
-async def search_clave_prod_and_taxonomy(q: str, db: Session = Depends(get_db)):
-    search_term_full = q.lower()
-    words_in_search = q.lower().split()
+async def search_clave_prod_and_taxonomy(
+    q: str,
+    limit: int = Query(50, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+    format: Literal["records", "columnar"] = "records",
+    as_of: Optional[date] = None,
+):
+    # Misma llave para búsquedas que compilan a la misma consulta FTS, por snapshot;
+    # se guarda el cuerpo ya codificado para no volver a serializar en cada acierto
+    key = (active_snapshot(), " ".join(tokenize_query(q)), limit, offset, format, as_of)
+    body = search_cache.get(key)
+    if body is None:
+        missing = await history_missing(as_of)
+        if missing is not None:
+            return missing
+        if CATALOG_ENGINE == "memory" and as_of is None:
+            rows = await run_db(search_rows_in_memory, await memory_engine(), q, limit=limit, offset=offset)
+        else:
+            rows = await run_db(search_rows, q, limit=limit, offset=offset, as_of=as_of)
+        encode = columnar if format == "columnar" else records
+        body = dumps(encode(SEARCH_COLUMNS, rows))
+        search_cache.put(key, body)
+    return Response(content=body, media_type="application/json")
+
+
+@app.get("/search_cache_stats")
+async def search_cache_stats():
+    return search_cache.stats()
+
+
+class BatchLookup(BaseModel):
+    # Las claves pueden llegar como texto ("01010101") o como número (1010101)
+    codes: List[Union[str, int]] = []
+    queries: List[str] = []
+    limit: int = Field(5, ge=1, le=50)
+    as_of: Optional[date] = None
+
+
+async def batch_lookups(body):
+    """Funciones (codes, queries) para el lote: el motor en memoria si está activo, o SQLite."""
+    if CATALOG_ENGINE == "memory" and body.as_of is None:
+        engine = await memory_engine()
+        return (
+            lambda codes: run_db(engine.lookup_codes, codes),
+            lambda queries: run_db(engine.lookup_queries, queries, limit=body.limit),
+        )
+    return (
+        lambda codes: run_db(lookup_codes, codes, as_of=body.as_of),
+        lambda queries: run_db(lookup_queries, queries, limit=body.limit, as_of=body.as_of),
+    )
+
+
+async def batch_lookup_lines(body):
+    # Se responde por bloques: la primera línea sale sin esperar a que termine todo el lote
+    find_codes, find_queries = await batch_lookups(body)
+    for chunk_start in range(0, len(body.codes), LOOKUP_CHUNK):
+        for item in await find_codes(body.codes[chunk_start:chunk_start + LOOKUP_CHUNK]):
+            yield dumps(item) + b"\n"
+    for chunk_start in range(0, len(body.queries), QUERY_CHUNK):
+        for item in await find_queries(body.queries[chunk_start:chunk_start + QUERY_CHUNK]):
+            yield dumps(item) + b"\n"
+
+
+@app.post("/batch_lookup")
+async def batch_lookup(body: BatchLookup, request: Request):
+    if len(body.codes) > MAX_BATCH_CODES or len(body.queries) > MAX_BATCH_QUERIES:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"At most {MAX_BATCH_CODES} codes and {MAX_BATCH_QUERIES} queries per request"},
+        )
+    missing = await history_missing(body.as_of)
+    if missing is not None:
+        return missing
 
-    try:
-        full_ids = db.execute(
-            text("SELECT c_ClaveProdServ FROM clave_prod_serv_fts WHERE clave_prod_serv_fts MATCH :match"),
-            {"match": f'"{search_term_full}"'}
-        ).fetchall()
-        full_ids = [x[0] for x in full_ids]
-    except Exception:
-        db.rollback()
-        full_ids = []
-
-    results = db.query(ClaveProdServ, Classification).join(
-        Classification,
-        cast(ClaveProdServ.c_ClaveProdServ / 100, Integer) == Classification.Clase_num
-    ).filter(
-        ClaveProdServ.c_ClaveProdServ.in_(full_ids)
-    ).all()
-
-    exact_result = []
-    for prod, cls in results:
-        exact_result.append({
-            "c_ClaveProdServ": prod.c_ClaveProdServ,
-            "Descripcion": prod.Descripcion,
-            "Palabras_similares": prod.Palabras_similares,
-            "tipo_num": cls.tipo_num,
-            "Tipo": cls.Tipo,
-            "Div_num": cls.Div_num,
-            "Division": cls.Division,
-            "Grupo_num": cls.Grupo_num,
-            "Grupo": cls.Grupo,
-            "Clase_num": cls.Clase_num,
-            "Clase": cls.Clase
-        })
-
-    partial_ids = set()
-    try:
-        for word in words_in_search:
-            ids = db.execute(
-                text("SELECT c_ClaveProdServ FROM clave_prod_serv_fts WHERE clave_prod_serv_fts MATCH :match"),
-                {"match": word}
-            ).fetchall()
-            partial_ids.update([x[0] for x in ids])
-    except Exception:
-        db.rollback()
-        partial_ids = set()
-
-    partial_ids.difference_update({r["c_ClaveProdServ"] for r in exact_result})
-
-    results = db.query(ClaveProdServ, Classification).join(
-        Classification,
-        cast(ClaveProdServ.c_ClaveProdServ / 100, Integer) == Classification.Clase_num
-    ).filter(
-        ClaveProdServ.c_ClaveProdServ.in_(partial_ids)
-    ).all()
-
-    or_results = []
-    for prod, cls in results:
-        or_results.append({
-            "c_ClaveProdServ": prod.c_ClaveProdServ,
-            "Descripcion": prod.Descripcion,
-            "Palabras_similares": prod.Palabras_similares,
-            "tipo_num": cls.tipo_num,
-            "Tipo": cls.Tipo,
-            "Div_num": cls.Div_num,
-            "Division": cls.Division,
-            "Grupo_num": cls.Grupo_num,
-            "Grupo": cls.Grupo,
-            "Clase_num": cls.Clase_num,
-            "Clase": cls.Clase
-        })
-
-    return exact_result + or_results
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        return StreamingResponse(batch_lookup_lines(body), media_type="application/x-ndjson")
+    find_codes, find_queries = await batch_lookups(body)
+    return {"codes": await find_codes(body.codes), "queries": await find_queries(body.queries)}
+
+
+@app.get("/autocomplete")
+async def autocomplete_endpoint(q: str, limit: int = Query(10, ge=1, le=50)):
+    return await run_db(autocomplete, q, limit=limit)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,108 @@
+"""
+Compara el motor en memoria (CATALOG_ENGINE=memory) con las consultas a SQLite.
+
+    python scripts/bench_engine.py --snapshot /app/data/catalog_20250101_....sqlite
+
+Mide la construcción del motor y la latencia de consultas por clave (una y en
+lote) y de búsquedas de texto, y verifica que ambos caminos den los mismos
+resultados. Sin --snapshot usa el snapshot vigente.
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import statistics
+import tracemalloc
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+QUERIES = [
+    "tarjeta de credito",
+    "servicios de consultoria",
+    "papel",
+    "computadora portatil",
+    "renta de oficinas",
+    "gasolina",
+    "medicamentos",
+    "transporte de carga",
+    "software",
+    "alimentos preparados",
+]
+
+
+def _timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main(snapshot, repeat, batch):
+    from session import open_snapshot
+    from src.catalog_engine import get_catalog_engine
+    from src.lookup import lookup_codes, lookup_queries
+    from src.search import search_rows
+    from src.snapshot import current_snapshot, snapshot_catalog_date
+
+    snapshot = snapshot or current_snapshot()
+    if snapshot is None:
+        sys.exit("No snapshot found, pass --snapshot")
+    open_snapshot(snapshot)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    engine = get_catalog_engine(snapshot_catalog_date(snapshot))
+    build_seconds = time.perf_counter() - start
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1e6
+    tracemalloc.stop()
+    print(
+        f"engine: {len(engine)} rows, {len(engine.postings)} terms, "
+        f"built in {build_seconds:.2f}s, ~{memory_mb:.0f} MB"
+    )
+
+    codes = [str(code) for code in engine.codes.tolist()]
+    random.seed(0)
+    sample = random.sample(codes, min(batch, len(codes))) + ["99999999", "abc"]
+
+    mismatches = sum(
+        1 for expected, got in zip(lookup_codes(sample), engine.lookup_codes(sample)) if expected != got
+    )
+    different = [
+        q for q in QUERIES if search_rows(q, limit=20) != engine.search_rows(q, limit=20)
+    ]
+    print(f"lookup mismatches: {mismatches} of {len(sample)}; searches with different results: {different or 'none'}")
+
+    one = sample[:1]
+    rows = [
+        ("lookup 1 code", lambda: lookup_codes(one), lambda: engine.lookup_codes(one)),
+        (f"lookup {len(sample)} codes", lambda: lookup_codes(sample), lambda: engine.lookup_codes(sample)),
+        (
+            f"{len(QUERIES)} searches",
+            lambda: [search_rows(q, limit=20) for q in QUERIES],
+            lambda: [engine.search_rows(q, limit=20) for q in QUERIES],
+        ),
+        (
+            "batch queries",
+            lambda: lookup_queries(QUERIES, limit=5),
+            lambda: engine.lookup_queries(QUERIES, limit=5),
+        ),
+    ]
+    print(f"{'':<24}{'sqlite ms':>12}{'memory ms':>12}{'speedup':>10}")
+    for name, sqlite_func, memory_func in rows:
+        sqlite_ms = _timed(sqlite_func, repeat)
+        memory_ms = _timed(memory_func, repeat)
+        print(f"{name:<24}{sqlite_ms:>12.3f}{memory_ms:>12.3f}{sqlite_ms / memory_ms:>9.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--snapshot", help="Ruta del snapshot SQLite (por defecto el vigente)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=500, help="Claves por consulta en lote")
+    args = parser.parse_args()
+    main(args.snapshot, args.repeat, args.batch)
@@ -0,0 +1,146 @@
+"""
+Compara la conversión XLS -> parquet actual (por bloques al transformar y escribir) con la anterior.
+
+    python scripts/bench_parquet.py /app/catCFDI_V_4_20250101.xls
+
+Cada variante corre en un proceso nuevo para medir su pico de RSS por separado.
+Con --synthetic N genera un XLS de N filas (requiere xlwt) en lugar de usar uno real.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import tempfile
+import subprocess
+import unicodedata
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def legacy_transform(xls_path, parquet_path):
+    """Copia de la conversión original, para comparar."""
+    import pandas as pd
+    from src.catalogo_pull import CATALOG_COLUMNS
+
+    def remove_accents(text):
+        if not isinstance(text, str):
+            return ''
+        new_text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('utf-8')
+        return new_text if text != new_text else ''
+
+    df = pd.read_excel(pd.ExcelFile(xls_path), sheet_name="c_ClaveProdServ", skiprows=4)
+    df.columns = CATALOG_COLUMNS[:-1]
+    df['FechaInicioVigencia'] = pd.to_datetime(df['FechaInicioVigencia'], errors='coerce')
+    df['FechaFinVigencia'] = pd.to_datetime(df['FechaFinVigencia'], errors='coerce')
+    df['FechaInicioVigencia'] = df['FechaInicioVigencia'].apply(lambda x: x if pd.notna(x) else None)
+    df['FechaFinVigencia'] = df['FechaFinVigencia'].apply(lambda x: x if pd.notna(x) else None)
+    df['c_ClaveProdServ'] = pd.to_numeric(df['c_ClaveProdServ'], errors='coerce')
+    df['Combined'] = (
+        df['Descripcion'].fillna('').astype(str) + ' ' +
+        df['Palabras_similares'].fillna('').astype(str) + ' ' +
+        df['Descripcion'].fillna('').apply(remove_accents).astype(str) + ' ' +
+        df['Palabras_similares'].fillna('').apply(remove_accents).astype(str)
+    )
+    df.to_parquet(parquet_path, index=False)
+    return len(df)
+
+
+def chunked_transform(xls_path, parquet_path):
+    import src.catalogo_pull as catalogo_pull
+
+    directory = os.path.dirname(parquet_path)
+    catalogo_pull.CATALOG_DIR = directory
+    shutil.copyfile(xls_path, os.path.join(directory, "catCFDI_V_4_bench.xls"))
+    os.replace(catalogo_pull.transform_to_parquet("bench"), parquet_path)
+    import pyarrow.parquet as pq
+
+    return pq.ParquetFile(parquet_path).metadata.num_rows
+
+
+def write_synthetic_xls(path, rows):
+    import random
+    import datetime
+    import xlwt
+
+    words = "crédito niño acción café papel tarjeta servicio pingüino camión máquina oficina".split()
+    book = xlwt.Workbook()
+    sheet = book.add_sheet("c_ClaveProdServ")
+    date_style = xlwt.easyxf(num_format_str="DD/MM/YYYY")
+    headers = [
+        "c_ClaveProdServ", "Descripción", "IVA", "IEPS", "Complemento", "Inicio", "Fin", "Estímulo", "Palabras",
+    ]
+    for col, header in enumerate(headers):
+        sheet.write(4, col, header)
+    for i in range(rows):
+        row = 5 + i
+        sheet.write(row, 0, 10000000 + i)
+        sheet.write(row, 1, " ".join(random.sample(words, 4)))
+        sheet.write(row, 2, "Opcional")
+        sheet.write(row, 3, "No")
+        sheet.write(row, 5, datetime.datetime(2022, 1, 1), date_style)
+        sheet.write(row, 7, random.randint(0, 1))
+        sheet.write(row, 8, " ".join(random.sample(words, 3)))
+    book.save(path)
+
+
+def run_one(variant, xls_path, parquet_path):
+    start = time.perf_counter()
+    rows = {"legacy": legacy_transform, "chunked": chunked_transform}[variant](xls_path, parquet_path)
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "variant": variant,
+        "rows": rows,
+        "seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("xls", nargs="?")
+    parser.add_argument("--synthetic", type=int, help="Genera un XLS sintético con N filas")
+    parser.add_argument("--run", choices=["legacy", "chunked"], help=argparse.SUPPRESS)
+    parser.add_argument("--out", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        run_one(args.run, args.xls, args.out)
+        sys.exit(0)
+
+    workdir = tempfile.mkdtemp(prefix="bench_parquet_")
+    xls_path = args.xls
+    if args.synthetic:
+        xls_path = os.path.join(workdir, "synthetic.xls")
+        write_synthetic_xls(xls_path, args.synthetic)
+
+    outputs = {}
+    for variant in ("legacy", "chunked"):
+        outputs[variant] = os.path.join(workdir, f"{variant}.parquet")
+        subprocess.run(
+            [sys.executable, __file__, xls_path, "--run", variant, "--out", outputs[variant]],
+            check=True,
+            cwd=BACKEND_DIR,
+        )
+
+    import pandas as pd
+
+    legacy = pd.read_parquet(outputs["legacy"])
+    chunked = pd.read_parquet(outputs["chunked"])
+    # Combined ya no es comparable: ahora se guarda una sola vez y plegado (src/normalize.py)
+    same = (
+        legacy["c_ClaveProdServ"].astype("Int64").tolist() == chunked["c_ClaveProdServ"].tolist()
+        and all(legacy[c].equals(chunked[c]) for c in ("Descripcion", "Palabras_similares"))
+        # Una columna de fechas vacía queda como object en la versión anterior
+        and all(
+            pd.to_datetime(legacy[c]).astype("datetime64[us]").equals(chunked[c])
+            for c in ("FechaInicioVigencia", "FechaFinVigencia")
+        )
+    )
+    print(f"Codes, descriptions and dates identical: {same}")
+    shutil.rmtree(workdir)
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark de los backends de parseo de src/_scraper.py sobre páginas grabadas.
+
+    python scripts/bench_parsers.py --record fixtures/ --url http://pys.sat.gob.mx/PyS/catPyS.aspx
+    python scripts/bench_parsers.py --pages fixtures/
+
+Sin --pages se generan páginas con scripts/fake_pys_server.py y un __VIEWSTATE
+del tamaño indicado con --viewstate-kb.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import base64
+import argparse
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from src._scraper import PARSERS  # noqa: E402
+from src._scraper import PySSession  # noqa: E402
+
+SELECTS = ["cmbTipo", "cmbSegmento", "cmbFamilia", "cmbClase"]
+
+
+def record_pages(url: str, directory: str, families: int = 5) -> None:
+    """Graba la página inicial y algunas respuestas de postback tal como llegan del servidor."""
+    os.makedirs(directory, exist_ok=True)
+    session = PySSession(url, parser="fast")
+    pages = []
+
+    def keep(method, **kwargs):
+        response = session.session.request(method, url, timeout=session.timeout, **kwargs)
+        response.raise_for_status()
+        pages.append(response.text)
+        session.last_page = session.parser.parse(response.text)
+        return session.last_page
+
+    session._request = keep
+    types = [t for t in session.obtain_types() if t != "0"]
+    segments = [s for s in session.obtain_segments(types[0]) if s != "0"]
+    family_ids = [f for f in session.obtain_families(types[0], segments[0]) if f != "0"]
+    for family_id in family_ids[:families]:
+        session.obtain_classes(types[0], segments[0], family_id)
+
+    for i, page in enumerate(pages):
+        with open(os.path.join(directory, f"page_{i:03d}.html"), "w", encoding="utf-8") as f:
+            f.write(page)
+    print(f"Recorded {len(pages)} pages into {directory}")
+
+
+def synthetic_pages(viewstate_kb: int) -> List[str]:
+    from fake_pys_server import render_page
+
+    tree_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output.json")
+    with open(tree_path, "r", encoding="utf-8") as f:
+        tree = json.load(f)
+    padding = base64.b64encode(os.urandom(viewstate_kb * 768)).decode("ascii")
+    selections = [[], [tree[0]["key"]], [tree[0]["key"], tree[0]["segments"][0]["key"]]]
+    family = tree[0]["segments"][0]["families"][0]["key"]
+    selections.append(selections[-1] + [family])
+    return [
+        render_page(tree, selection).replace('value="" />', f'value="{padding}" />', 1)
+        for selection in selections
+    ]
+
+
+def bench(pages: List[str], repeat: int) -> None:
+    reference = None
+    for name, parser in PARSERS.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            extracted = []
+            for page in pages:
+                document = parser.parse(page)
+                extracted.append(
+                    (parser.form_state(document), [parser.select_values(document, s) for s in SELECTS])
+                )
+        elapsed = time.perf_counter() - start
+        per_page = elapsed / (repeat * len(pages)) * 1000
+        if reference is None:
+            reference = extracted
+        status = "ok" if extracted == reference else "MISMATCH"
+        print(f"{name:>6}: {per_page:8.3f} ms/page  ({status})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pages", help="Directorio con páginas .html grabadas")
+    parser.add_argument("--record", help="Graba páginas en este directorio y termina")
+    parser.add_argument("--url", default="http://pys.sat.gob.mx/PyS/catPyS.aspx")
+    parser.add_argument("--viewstate-kb", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.record:
+        record_pages(args.url, args.record)
+        sys.exit(0)
+
+    if args.pages:
+        pages = []
+        for path in sorted(glob.glob(os.path.join(args.pages, "*.html"))):
+            with open(path, "r", encoding="utf-8") as f:
+                pages.append(f.read())
+    else:
+        pages = synthetic_pages(args.viewstate_kb)
+    print(f"{len(pages)} pages, {sum(len(p) for p in pages) / len(pages) / 1024:.0f} KB average")
+    bench(pages, args.repeat)
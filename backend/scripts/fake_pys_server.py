@@ -0,0 +1,133 @@
+"""
+Servidor local que imita el formulario ASP.NET de catPyS.aspx a partir de un output.json.
+
+Sirve para probar el crawler sin red:
+
+    python scripts/fake_pys_server.py --port 8765 --source output.json
+    python -c "from src.generator import generate_pys_data; ..."  # url=http://127.0.0.1:8765/PyS/catPyS.aspx
+
+El __VIEWSTATE codifica la selección actual y las opciones renderizadas; un POST
+con un valor que no estaba en la página anterior responde 500, igual que el
+EventValidation del sitio real.
+"""
+
+import json
+import base64
+import argparse
+import html
+import threading
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any, Dict, List
+from urllib.parse import parse_qs
+
+LEVELS = [
+    ("cmbTipo", "segments"),
+    ("cmbSegmento", "families"),
+    ("cmbFamilia", "classes"),
+    ("cmbClase", None),
+]
+
+
+def _encode_state(state: Dict[str, Any]) -> str:
+    return base64.b64encode(json.dumps(state).encode("utf-8")).decode("ascii")
+
+
+def _decode_state(value: str) -> Dict[str, Any]:
+    return json.loads(base64.b64decode(value.encode("ascii")))
+
+
+def render_page(tree: List[Dict[str, Any]], selection: List[str]) -> str:
+    """Renderiza la página con los combos habilitados hasta el nivel seleccionado."""
+    selects = []
+    allowed = {}
+    nodes = tree
+    for depth, (select_id, children_key) in enumerate(LEVELS):
+        options = [("0", "Seleccione")]
+        if nodes is not None:
+            options += [(node["key"], node["name"]) for node in nodes]
+        allowed[select_id] = [key for key, _ in options]
+        selected = selection[depth] if depth < len(selection) else "0"
+        option_html = "".join(
+            f'<option value="{html.escape(key)}"{" selected" if key == selected else ""}>{html.escape(name)}</option>'
+            for key, name in options
+        )
+        selects.append(f'<select name="{select_id}" id="{select_id}">{option_html}</select>')
+
+        if nodes is None or depth >= len(selection) or children_key is None:
+            nodes = None
+            continue
+        match = next((node for node in nodes if node["key"] == selection[depth]), None)
+        nodes = match.get(children_key) if match else None
+
+    state = _encode_state({"selection": selection, "allowed": allowed})
+    return (
+        "<html><body><form method=\"post\" id=\"form1\">"
+        f'<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{state}" />'
+        '<input type="hidden" name="__EVENTTARGET" id="__EVENTTARGET" value="" />'
+        '<input type="hidden" name="__EVENTARGUMENT" id="__EVENTARGUMENT" value="" />'
+        f"{''.join(selects)}"
+        "</form></body></html>"
+    )
+
+
+def make_handler(tree: List[Dict[str, Any]]):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body: str) -> None:
+            payload = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            self._reply(200, render_page(tree, []))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", "0"))
+            form = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode("utf-8")).items()}
+            try:
+                previous = _decode_state(form["__VIEWSTATE"])
+            except (KeyError, ValueError):
+                return self._reply(500, "Invalid viewstate")
+
+            target = form.get("__EVENTTARGET")
+            select_ids = [select_id for select_id, _ in LEVELS]
+            if target not in select_ids:
+                return self._reply(500, "Invalid event target")
+
+            selection = []
+            for select_id in select_ids[: select_ids.index(target) + 1]:
+                value = form.get(select_id, "0")
+                if value not in previous["allowed"].get(select_id, []):
+                    return self._reply(500, f"Invalid postback value for {select_id}")
+                selection.append(value)
+            self._reply(200, render_page(tree, selection))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(source: str = "output.json", host: str = "127.0.0.1", port: int = 0, background: bool = False):
+    """Arranca el servidor; con background=True devuelve (server, url) sin bloquear."""
+    with open(source, "r", encoding="utf-8") as f:
+        tree = json.load(f)
+    server = ThreadingHTTPServer((host, port), make_handler(tree))
+    url = f"http://{host}:{server.server_address[1]}/PyS/catPyS.aspx"
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, url
+    print(f"Serving {source} at {url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--source", default="output.json")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    serve(args.source, args.host, args.port)
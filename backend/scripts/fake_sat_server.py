@@ -0,0 +1,160 @@
+"""
+Servidor local que imita la descarga de catálogos del SAT a partir de un directorio.
+
+Sirve para probar download_cfdi_catalog sin red:
+
+    python scripts/fake_sat_server.py --directory /tmp/sat --port 8766 --cut-after 100000
+    SAT_CATALOG_URL=http://127.0.0.1:8766 python -c "from src.catalogo_pull import download_cfdi_catalog; ..."
+
+Responde con ETag y Last-Modified, atiende If-None-Match / If-Modified-Since
+(304), Range e If-Range (206), HEAD (para descubrir versiones), y devuelve 404
+para archivos que no existen.
+Con --cut-after N corta la conexión después de N bytes en las primeras --cuts
+respuestas, para probar la reanudación.
+"""
+
+import os
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate
+from email.utils import parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Dict, Optional
+
+
+def _file_etag(path: str) -> str:
+    stat = os.stat(path)
+    return '"' + hashlib.sha1(f"{stat.st_size}-{stat.st_mtime_ns}".encode()).hexdigest() + '"'
+
+
+def make_handler(directory: str, cut_after: Optional[int], cuts: int, stats: Dict[str, int]):
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def _take_cut(self) -> bool:
+            with lock:
+                if cut_after is None or stats["cuts"] >= cuts:
+                    return False
+                stats["cuts"] += 1
+                return True
+
+        def _not_modified(self, etag: str, mtime: float) -> bool:
+            if_none_match = self.headers.get("If-None-Match")
+            if if_none_match is not None:
+                return etag in [tag.strip() for tag in if_none_match.split(",")]
+            since = self.headers.get("If-Modified-Since")
+            if since:
+                try:
+                    return int(mtime) <= parsedate_to_datetime(since).timestamp()
+                except (TypeError, ValueError):
+                    return False
+            return False
+
+        def _range_start(self, etag: str, last_modified: str) -> Optional[int]:
+            requested = self.headers.get("Range", "")
+            if not requested.startswith("bytes=") or not requested.endswith("-"):
+                return None
+            if_range = self.headers.get("If-Range")
+            if if_range is not None and if_range not in (etag, last_modified):
+                return None
+            start = requested[len("bytes="):-1]
+            return int(start) if start.isdigit() else None
+
+        def do_HEAD(self):
+            with lock:
+                stats["heads"] += 1
+            self._respond(body=False)
+
+        def do_GET(self):
+            with lock:
+                stats["requests"] += 1
+            self._respond(body=True)
+
+        def _respond(self, body: bool):
+            path = os.path.join(directory, os.path.basename(self.path))
+            if not os.path.isfile(path):
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            stat = os.stat(path)
+            etag = _file_etag(path)
+            last_modified = formatdate(stat.st_mtime, usegmt=True)
+            if self._not_modified(etag, stat.st_mtime):
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.end_headers()
+                return
+
+            start = self._range_start(etag, last_modified)
+            if start is not None and start >= stat.st_size:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{stat.st_size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self.send_response(206 if start else 200)
+            if start:
+                self.send_header("Content-Range", f"bytes {start}-{stat.st_size - 1}/{stat.st_size}")
+            start = start or 0
+            self.send_header("Content-Type", "application/vnd.ms-excel")
+            self.send_header("Content-Length", str(stat.st_size - start))
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            if not body:
+                return
+
+            limit = cut_after if self._take_cut() else None
+            with open(path, "rb") as f:
+                f.seek(start)
+                sent = 0
+                for chunk in iter(lambda: f.read(64 * 1024), b""):
+                    if limit is not None and sent + len(chunk) > limit:
+                        self.wfile.write(chunk[: limit - sent])
+                        self.wfile.flush()
+                        # Cerrar sin completar Content-Length, como una conexión caída
+                        self.close_connection = True
+                        return
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+
+    return Handler
+
+
+def serve(
+    directory: str,
+    host: str = "127.0.0.1",
+    port: int = 0,
+    background: bool = False,
+    cut_after: Optional[int] = None,
+    cuts: int = 1,
+):
+    """Arranca el servidor; con background=True devuelve (server, url, stats) sin bloquear."""
+    stats = {"requests": 0, "heads": 0, "cuts": 0}
+    server = ThreadingHTTPServer((host, port), make_handler(directory, cut_after, cuts, stats))
+    url = f"http://{host}:{server.server_address[1]}"
+    if background:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server, url, stats
+    print(f"Serving {directory} at {url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--directory", required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--cut-after", type=int, help="Corta la conexión después de N bytes")
+    parser.add_argument("--cuts", type=int, default=1, help="Cuántas respuestas cortar")
+    args = parser.parse_args()
+    serve(args.directory, args.host, args.port, cut_after=args.cut_after, cuts=args.cuts)
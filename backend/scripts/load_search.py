@@ -0,0 +1,142 @@
+"""
+Prueba de carga: latencia de /search_clave_prod_and_taxonomy antes y durante un /load_db.
+
+    python scripts/load_search.py --url http://localhost:8080 --clients 16 --seconds 10
+
+Mide una ventana base y luego dispara /load_db y sigue midiendo mientras corre la
+recarga; si el servidor no bloquea el event loop, el p99 de ambas fases debe ser similar.
+
+Las búsquedas combinan palabras al azar con un offset al azar para que casi todas
+fallen en la caché de resultados y lleguen al índice; con --cached se repiten las
+mismas QUERIES y se mide el camino de la caché.
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+import statistics
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+QUERIES = [
+    "tarjeta de credito",
+    "servicios de consultoria",
+    "papel",
+    "computadora portatil",
+    "renta de oficinas",
+    "gasolina",
+    "medicamentos",
+    "transporte de carga",
+    "software",
+    "alimentos preparados",
+]
+# Palabras frecuentes del catálogo para armar búsquedas que no estén en la caché
+WORDS = [
+    "servicio", "servicios", "equipo", "equipos", "material", "materiales", "sistema", "tarjeta",
+    "papel", "madera", "metal", "acero", "plastico", "vidrio", "agua", "aceite", "gas", "electrico",
+    "cable", "motor", "bomba", "valvula", "tubo", "herramienta", "maquina", "vehiculo", "transporte",
+    "carga", "oficina", "computadora", "software", "red", "medico", "medicamento", "laboratorio",
+    "alimento", "bebida", "fruta", "carne", "ropa", "calzado", "mueble", "construccion", "limpieza",
+    "seguridad", "consultoria", "mantenimiento", "reparacion", "renta", "educacion", "publicidad",
+]
+MAX_OFFSET = 200
+
+
+def _random_search(cached: bool):
+    if cached:
+        return random.choice(QUERIES), 0
+    query = " ".join(random.sample(WORDS, random.randint(1, 3)))
+    return query, random.randrange(0, MAX_OFFSET + 1, 10)
+
+
+def _search(base_url: str, query: str, offset: int = 0) -> float:
+    params = urllib.parse.urlencode({"q": query, "offset": offset})
+    url = f"{base_url}/search_clave_prod_and_taxonomy?{params}"
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=60) as response:
+        response.read()
+    return (time.perf_counter() - start) * 1000
+
+
+def _measure(base_url: str, clients: int, stop: threading.Event, cached: bool = False) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def client() -> None:
+        while not stop.is_set():
+            elapsed = _search(base_url, *_random_search(cached))
+            with lock:
+                latencies.append(elapsed)
+
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        for _ in range(clients):
+            pool.submit(client)
+    return latencies
+
+
+def _cache_stats(base_url: str) -> dict:
+    with urllib.request.urlopen(f"{base_url}/search_cache_stats", timeout=60) as response:
+        return json.loads(response.read())
+
+
+def _report(name: str, latencies: List[float]) -> None:
+    if not latencies:
+        print(f"{name:>10}: no requests completed")
+        return
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(
+        f"{name:>10}: {len(ordered):6d} req  p50 {statistics.median(ordered):7.1f} ms  "
+        f"p99 {p99:7.1f} ms  max {ordered[-1]:7.1f} ms"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", default="http://localhost:8080")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--reload-path", default="/load_db")
+    parser.add_argument("--cached", action="store_true", help="Repetir QUERIES (aciertos de la caché)")
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    threading.Timer(args.seconds, stop.set).start()
+    cache_before = _cache_stats(args.url)
+    baseline = _measure(args.url, args.clients, stop, args.cached)
+
+    reload_done = threading.Event()
+    reload_time = {}
+
+    def reload() -> None:
+        start = time.perf_counter()
+        with urllib.request.urlopen(f"{args.url}{args.reload_path}", timeout=3600) as response:
+            job = json.loads(response.read())["job"]
+        # La recarga corre como trabajo en segundo plano; esperar a que termine
+        while job["status"] in ("queued", "running", "cancelling"):
+            time.sleep(0.5)
+            with urllib.request.urlopen(f"{args.url}/jobs/{job['id']}", timeout=60) as response:
+                job = json.loads(response.read())
+        reload_time["seconds"] = time.perf_counter() - start
+        reload_time["status"] = job["status"]
+        reload_done.set()
+
+    threading.Thread(target=reload, daemon=True).start()
+    during = _measure(args.url, args.clients, reload_done, args.cached)
+    cache_after = _cache_stats(args.url)
+
+    _report("baseline", baseline)
+    _report("reload", during)
+    # La recarga vacía la caché pero no sus contadores
+    hits = cache_after["hits"] - cache_before["hits"]
+    misses = cache_after["misses"] - cache_before["misses"]
+    print(f"search cache: {hits} hits, {misses} misses")
+    print(f"reload {reload_time.get('status')} in {reload_time.get('seconds', float('nan')):.1f}s")
+
+
+if __name__ == "__main__":
+    main()
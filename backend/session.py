@@ -1,11 +1,90 @@
 from sqlalchemy import create_engine
+from sqlalchemy import event
 from sqlalchemy.orm import sessionmaker
 from functools import wraps
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
 
 DATABASE_URL = "sqlite:///:memory:"
 engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Los snapshots son de solo lectura y nunca se modifican después de construirse
+SNAPSHOT_PRAGMAS = [
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA query_only = 1",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16384",
+]
+
+
+def _apply_snapshot_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in SNAPSHOT_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.close()
+
+
+def create_snapshot_engine(path):
+    # immutable=1: el archivo es de una sola escritura, así que SQLite no necesita
+    # locks ni journal y todos los workers comparten las páginas mapeadas del SO.
+    snapshot_engine = create_engine(
+        f"sqlite:///file:{path}?mode=ro&immutable=1&uri=true",
+        connect_args={"check_same_thread": False},
+        pool_size=8,
+        max_overflow=16,
+    )
+    event.listen(snapshot_engine, "connect", _apply_snapshot_pragmas)
+    return snapshot_engine
+
+
+# Engine vigente y su archivo; el anterior se retira cuando terminan sus consultas
+_swap_lock = threading.Lock()
+_active_path = None
+DRAIN_TIMEOUT = 300
+
+
+def _retire(old_engine, old_path):
+    """Espera a que el engine anterior no tenga conexiones en uso y luego lo cierra."""
+
+    def drain():
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        checkedout = getattr(old_engine.pool, "checkedout", lambda: 0)
+        while checkedout() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        old_engine.dispose()
+        logger.info(f"Retired database {old_path or DATABASE_URL}")
+
+    threading.Thread(target=drain, name="engine-drain", daemon=True).start()
+
+
+def open_snapshot(path):
+    """
+    Cambia atómicamente la base que atienden las sesiones nuevas.
+
+    El snapshot nuevo se abre y valida antes del cambio; las sesiones que ya
+    estaban consultando terminan sobre el anterior, que se cierra al quedar libre.
+    """
+    global engine, _active_path
+    new_engine = create_snapshot_engine(path)
+    with new_engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1 FROM clave_prod_serv_search LIMIT 1").fetchall()
+
+    with _swap_lock:
+        old_engine, old_path = engine, _active_path
+        engine, _active_path = new_engine, path
+        SessionLocal.configure(bind=new_engine)
+    logger.info(f"Serving database snapshot {path}")
+    _retire(old_engine, old_path)
+    return engine
+
+
+def active_snapshot():
+    return _active_path
+
 
 def get_db():
     db = SessionLocal()
@@ -18,6 +97,9 @@ def get_db():
 def with_db(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
+        if kwargs.get("db") is not None:
+            return func(*args, **kwargs)
+        kwargs.pop("db", None)
         db = SessionLocal()
         try:
             return func(*args, db=db, **kwargs)
@@ -2,11 +2,14 @@
 Funciones para exportar datos a XML y JSON
 """
 
+import os
 import json
 import logging
 import xml.dom.minidom as minidom
 import xml.etree.ElementTree as ET
-from typing import Dict, List, Any, Optional
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
+
+from src.file_lock import replace_atomically
 
 logger = logging.getLogger(__name__)
 
@@ -83,6 +86,7 @@ def export_to_json(
     Args:
         data: Datos estructurados del catálogo PyS.
         output_file: Ruta del archivo donde guardar el JSON. Si es None, solo devuelve los datos.
+            Junto a él se escribe la versión aplanada (ver write_flat_classes).
 
     Returns:
         List[Dict[str, Any]]: Datos estructurados si output_file es None, None en caso contrario.
@@ -93,6 +97,7 @@ def export_to_json(
         try:
             with open(output_file, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
+            write_flat_classes(output_file, flatten_classes(data))
             logger.info("JSON file saved successfully")
         except Exception as e:
             logger.error(f"Error saving JSON file: {str(e)}")
@@ -101,3 +106,50 @@ def export_to_json(
 
     logger.info("JSON export completed, returning data")
     return data
+
+
+def flatten_classes(data: Iterable[Dict[str, Any]]) -> Iterator[Tuple]:
+    """
+    Una tupla por Clase: (tipo_num, Tipo, Div_num, Division, Grupo_num, Grupo, Clase_num, Clase).
+
+    data puede ser la lista completa o un iterador de Tipos leídos uno a uno.
+    """
+    for type_data in data:
+        for segment_data in type_data.get("segments", []):
+            for family_data in segment_data.get("families", []):
+                for class_data in family_data.get("classes", []):
+                    yield (
+                        type_data["key"], type_data["name"],
+                        segment_data["key"], segment_data["name"],
+                        family_data["key"], family_data["name"],
+                        class_data["key"], class_data["name"],
+                    )
+
+
+def flat_classes_path(json_file: str) -> str:
+    return f"{json_file}.classes.jsonl"
+
+
+def source_signature(json_file: str) -> Dict[str, int]:
+    stat = os.stat(json_file)
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def write_flat_classes(json_file: str, rows: Iterable[Tuple]) -> int:
+    """
+    Escribe json_file.classes.jsonl: una primera línea con el mtime y tamaño de
+    json_file y luego una lista JSON por Clase. Se puede leer línea por línea sin
+    cargar el árbol; si json_file cambia, la firma deja de coincidir.
+
+    Returns:
+        int: Clases escritas.
+    """
+    path = flat_classes_path(json_file)
+    count = 0
+    with replace_atomically(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(source_signature(json_file)) + "\n")
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            count += 1
+    logger.info(f"Saved {count} flattened classes to {path}")
+    return count
@@ -2,10 +2,17 @@
 Funciones para extraer datos del sitio web del SAT
 """
 
+import os
+import re
+import html
+import time
+import threading
 import requests
 import logging
 from bs4 import BeautifulSoup
-from typing import Dict
+from typing import Any, Dict, Optional
+
+from src.metrics import SCRAPER_REQUESTS, SCRAPER_REQUEST_DURATION
 
 # Configure logger
 logger = logging.getLogger(__name__)
@@ -13,61 +20,270 @@ logger = logging.getLogger(__name__)
 # URL principal del sitio
 PYS_URL = "http://pys.sat.gob.mx/PyS/catPyS.aspx"
 
-# Variables para mantener el estado entre solicitudes
-_session = requests.Session()
-_last_soup = None
-
-
-def _send_get() -> BeautifulSoup:
-    """Envía una solicitud GET a la URL principal y devuelve el soup."""
-    global _last_soup
-
-    logger.info(f"Sending GET request to {PYS_URL}")
-    try:
-        response = _session.get(PYS_URL)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        _last_soup = soup
-        logger.debug("GET request successful")
-        return soup
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error in GET request: {str(e)}")
-        raise
-
-
-def _send_post(data: Dict[str, str]) -> BeautifulSoup:
-    """Envía una solicitud POST con los datos proporcionados y devuelve el soup."""
-    global _last_soup
-
-    if not _last_soup:
-        logger.error("No previous request made, _last_soup is None")
-        raise ValueError("No se ha realizado una solicitud previa")
-
-    # Extraer el estado del formulario actual
-    form_state = _extract_form_state(_last_soup)
-
-    # Combinar con los datos proporcionados
-    full_data = {**form_state, **data, "__ASYNCPOST": "false"}
-
-    headers = {
-        "Accept-Encoding": "gzip, deflate",
-        "Referer": PYS_URL,
-        "X-Requested-With": "XMLHttpRequest",
-        "X-Microsoft-Ajax": "delta=false",
-    }
-
-    logger.info(f"Sending POST request to {PYS_URL}")
-    logger.debug(f"POST data: {data}")
-    try:
-        response = _session.post(PYS_URL, data=full_data, headers=headers)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        _last_soup = soup
-        logger.debug("POST request successful")
-        return soup
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Error in POST request: {str(e)}")
-        raise
+
+class RateLimiter:
+    """Limita el número de solicitudes por segundo, compartido entre varias sesiones."""
+
+    def __init__(self, requests_per_second: Optional[float] = None):
+        self.interval = 1.0 / requests_per_second if requests_per_second else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class _SoupParser:
+    """Backend original: árbol completo con BeautifulSoup."""
+
+    def __init__(self, features: str = "html.parser"):
+        self.features = features
+
+    def parse(self, page: str) -> BeautifulSoup:
+        return BeautifulSoup(page, self.features)
+
+    def select_values(self, document: BeautifulSoup, select_id: str) -> Dict[str, str]:
+        return _extract_select_values(document, select_id)
+
+    def form_state(self, document: BeautifulSoup) -> Dict[str, str]:
+        return _extract_form_state(document)
+
+
+class _ScanParser:
+    """Backend rápido: recorre el HTML crudo y solo lee los inputs del form y el select pedido."""
+
+    def parse(self, page: str) -> str:
+        return page
+
+    def select_values(self, document: str, select_id: str) -> Dict[str, str]:
+        return _scan_select_values(document, select_id)
+
+    def form_state(self, document: str) -> Dict[str, str]:
+        return _scan_form_state(document)
+
+
+PARSERS: Dict[str, Any] = {"bs4": _SoupParser(), "fast": _ScanParser()}
+try:
+    import lxml  # noqa: F401
+
+    PARSERS["lxml"] = _SoupParser("lxml")
+except ImportError:
+    pass
+
+DEFAULT_PARSER = os.environ.get("PYS_PARSER", "fast")
+
+
+def get_parser(name: Optional[str] = None):
+    """Devuelve el backend de parseo por nombre ("fast", "bs4" o "lxml" si está instalado)."""
+    name = name or DEFAULT_PARSER
+    if name not in PARSERS:
+        raise ValueError(f"Unknown parser '{name}', available: {sorted(PARSERS)}")
+    return PARSERS[name]
+
+
+class PySSession:
+    """
+    Sesión independiente contra catPyS.aspx.
+
+    Cada instancia guarda su propio estado del formulario ASP.NET (la última
+    página recibida), de modo que varias sesiones pueden recorrer el catálogo
+    en paralelo sin pisarse el __VIEWSTATE.
+    """
+
+    def __init__(
+        self,
+        url: str = PYS_URL,
+        rate_limiter: Optional[RateLimiter] = None,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 60.0,
+        parser: Optional[str] = None,
+    ):
+        self.url = url
+        self.parser = get_parser(parser)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.last_page = None
+
+    def _request(self, method: str, **kwargs) -> Any:
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, self.url, timeout=self.timeout, **kwargs)
+                response.raise_for_status()
+                page = self.parser.parse(response.text)
+                self.last_page = page
+                SCRAPER_REQUEST_DURATION.labels(method=method).observe(time.perf_counter() - start)
+                SCRAPER_REQUESTS.labels(method=method, outcome="ok").inc()
+                logger.debug(f"{method} request successful")
+                return page
+            except requests.exceptions.RequestException as e:
+                SCRAPER_REQUEST_DURATION.labels(method=method).observe(time.perf_counter() - start)
+                if attempt == self.retries:
+                    SCRAPER_REQUESTS.labels(method=method, outcome="error").inc()
+                    logger.error(f"Error in {method} request: {str(e)}")
+                    raise
+                SCRAPER_REQUESTS.labels(method=method, outcome="retry").inc()
+                delay = self.backoff * 2**attempt
+                logger.warning(f"{method} request failed ({str(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def send_get(self) -> Any:
+        """Envía una solicitud GET a la URL principal y devuelve la página parseada."""
+        logger.info(f"Sending GET request to {self.url}")
+        return self._request("GET")
+
+    def send_post(self, data: Dict[str, str]) -> Any:
+        """Envía una solicitud POST con los datos proporcionados y devuelve la página parseada."""
+        if self.last_page is None:
+            logger.error("No previous request made, last_page is None")
+            raise ValueError("No se ha realizado una solicitud previa")
+
+        # Extraer el estado del formulario actual y combinar con los datos proporcionados
+        form_state = self.parser.form_state(self.last_page)
+        full_data = {**form_state, **data, "__ASYNCPOST": "false"}
+
+        headers = {
+            "Accept-Encoding": "gzip, deflate",
+            "Referer": self.url,
+            "X-Requested-With": "XMLHttpRequest",
+            "X-Microsoft-Ajax": "delta=false",
+        }
+
+        logger.info(f"Sending POST request to {self.url}")
+        logger.debug(f"POST data: {data}")
+        return self._request("POST", data=full_data, headers=headers)
+
+    def obtain_types(self) -> Dict[str, str]:
+        """Obtiene la lista de tipos desde la página principal."""
+        logger.info("Obtaining types list")
+        page = self.send_get()
+        types = self.parser.select_values(page, "cmbTipo")
+        logger.info(f"Found {len(types)} types")
+        return types
+
+    def obtain_segments(self, type_id: str) -> Dict[str, str]:
+        """Obtiene la lista de segmentos para un tipo determinado."""
+        logger.info(f"Obtaining segments for type ID: {type_id}")
+        inputs = {
+            "myScript": "pnlTipo|cmbTipo",
+            "__EVENTTARGET": "cmbTipo",
+            "cmbTipo": type_id,
+        }
+        page = self.send_post(inputs)
+        segments = self.parser.select_values(page, "cmbSegmento")
+        logger.info(f"Found {len(segments)} segments for type ID: {type_id}")
+        return segments
+
+    def obtain_families(self, type_id: str, segment_id: str) -> Dict[str, str]:
+        """Obtiene la lista de familias para un tipo y segmento determinados."""
+        logger.info(f"Obtaining families for type ID: {type_id}, segment ID: {segment_id}")
+        inputs = {
+            "myScript": "pnlSegmento|cmbSegmento",
+            "__EVENTTARGET": "cmbSegmento",
+            "cmbTipo": type_id,
+            "cmbSegmento": segment_id,
+        }
+        page = self.send_post(inputs)
+        families = self.parser.select_values(page, "cmbFamilia")
+        logger.info(
+            f"Found {len(families)} families for type ID: {type_id}, segment ID: {segment_id}"
+        )
+        return families
+
+    def obtain_classes(self, type_id: str, segment_id: str, family_id: str) -> Dict[str, str]:
+        """Obtiene la lista de clases para un tipo, segmento y familia determinados."""
+        logger.info(
+            f"Obtaining classes for type ID: {type_id}, segment ID: {segment_id}, family ID: {family_id}"
+        )
+        inputs = {
+            "myScript": "pnlFamilia|cmbFamilia",
+            "__EVENTTARGET": "cmbFamilia",
+            "cmbTipo": type_id,
+            "cmbSegmento": segment_id,
+            "cmbFamilia": family_id,
+        }
+        page = self.send_post(inputs)
+        classes = self.parser.select_values(page, "cmbClase")
+        logger.info(
+            f"Found {len(classes)} classes for type ID: {type_id}, segment ID: {segment_id}, family ID: {family_id}"
+        )
+        return classes
+
+
+_TAG_RE = re.compile(r"<[^>]*>")
+_ATTR_RE = re.compile(r"""([^\s=/>]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?""")
+_INPUT_RE = re.compile(r"<input\b([^>]*)>", re.IGNORECASE)
+_OPTION_RE = re.compile(r"<option\b([^>]*)>(.*?)(?=<option\b|</option>|</select>|\Z)", re.IGNORECASE | re.DOTALL)
+_FORM_RE = re.compile(r"<form\b([^>]*)>", re.IGNORECASE)
+_FORM_END_RE = re.compile(r"</form\s*>", re.IGNORECASE)
+_SELECT_RE = re.compile(r"<select\b([^>]*)>", re.IGNORECASE)
+_SELECT_END_RE = re.compile(r"</select\s*>", re.IGNORECASE)
+
+
+def _scan_attrs(raw: str) -> Dict[str, str]:
+    attrs = {}
+    for match in _ATTR_RE.finditer(raw):
+        name = match.group(1).lower()
+        if name not in attrs:
+            value = next((g for g in match.group(2, 3, 4) if g is not None), "")
+            attrs[name] = html.unescape(value)
+    return attrs
+
+
+def _scan_element(page: str, tag_re: re.Pattern, element_id: str, end_re: re.Pattern) -> Optional[str]:
+    """Devuelve el contenido de la primera etiqueta con ese id, sin construir el árbol."""
+    for match in tag_re.finditer(page):
+        if _scan_attrs(match.group(1)).get("id") == element_id:
+            end = end_re.search(page, match.end())
+            return page[match.end():end.start() if end else len(page)]
+    return None
+
+
+def _scan_select_values(page: str, select_id: str) -> Dict[str, str]:
+    """Equivalente a _extract_select_values sobre HTML crudo."""
+    body = _scan_element(page, _SELECT_RE, select_id, _SELECT_END_RE)
+    if body is None:
+        logger.warning(f"Select with id '{select_id}' not found")
+        return {}
+
+    values = {}
+    for match in _OPTION_RE.finditer(body):
+        key = _scan_attrs(match.group(1)).get("value", "")
+        if key:  # Excluir opciones sin valor
+            values[key] = html.unescape(_TAG_RE.sub("", match.group(2)))
+    return values
+
+
+def _scan_form_state(page: str) -> Dict[str, str]:
+    """Equivalente a _extract_form_state sobre HTML crudo."""
+    form = _scan_element(page, _FORM_RE, "form1", _FORM_END_RE)
+    if form is None:
+        logger.warning("Form with id 'form1' not found")
+        return {}
+
+    result = {}
+    for match in _INPUT_RE.finditer(form):
+        attrs = _scan_attrs(match.group(1))
+        name = attrs.get("name")
+        if name and attrs.get("type", "").lower() in ("hidden", "text"):
+            result[name] = attrs.get("value", "")
+    return result
+
+
+# Sesión por defecto usada por las funciones de módulo
+_default_session = PySSession()
 
 
 def _extract_select_values(soup: BeautifulSoup, select_id: str) -> Dict[str, str]:
@@ -110,59 +326,19 @@ def _extract_form_state(soup: BeautifulSoup) -> Dict[str, str]:
 
 def obtain_types() -> Dict[str, str]:
     """Obtiene la lista de tipos desde la página principal."""
-    logger.info("Obtaining types list")
-    soup = _send_get()
-    types = _extract_select_values(soup, "cmbTipo")
-    logger.info(f"Found {len(types)} types")
-    return types
+    return _default_session.obtain_types()
 
 
 def obtain_segments(type_id: str) -> Dict[str, str]:
     """Obtiene la lista de segmentos para un tipo determinado."""
-    logger.info(f"Obtaining segments for type ID: {type_id}")
-    inputs = {
-        "myScript": "pnlTipo|cmbTipo",
-        "__EVENTTARGET": "cmbTipo",
-        "cmbTipo": type_id,
-    }
-    soup = _send_post(inputs)
-    segments = _extract_select_values(soup, "cmbSegmento")
-    logger.info(f"Found {len(segments)} segments for type ID: {type_id}")
-    return segments
+    return _default_session.obtain_segments(type_id)
 
 
 def obtain_families(type_id: str, segment_id: str) -> Dict[str, str]:
     """Obtiene la lista de familias para un tipo y segmento determinados."""
-    logger.info(f"Obtaining families for type ID: {type_id}, segment ID: {segment_id}")
-    inputs = {
-        "myScript": "pnlSegmento|cmbSegmento",
-        "__EVENTTARGET": "cmbSegmento",
-        "cmbTipo": type_id,
-        "cmbSegmento": segment_id,
-    }
-    soup = _send_post(inputs)
-    families = _extract_select_values(soup, "cmbFamilia")
-    logger.info(
-        f"Found {len(families)} families for type ID: {type_id}, segment ID: {segment_id}"
-    )
-    return families
+    return _default_session.obtain_families(type_id, segment_id)
 
 
 def obtain_classes(type_id: str, segment_id: str, family_id: str) -> Dict[str, str]:
     """Obtiene la lista de clases para un tipo, segmento y familia determinados."""
-    logger.info(
-        f"Obtaining classes for type ID: {type_id}, segment ID: {segment_id}, family ID: {family_id}"
-    )
-    inputs = {
-        "myScript": "pnlFamilia|cmbFamilia",
-        "__EVENTTARGET": "cmbFamilia",
-        "cmbTipo": type_id,
-        "cmbSegmento": segment_id,
-        "cmbFamilia": family_id,
-    }
-    soup = _send_post(inputs)
-    classes = _extract_select_values(soup, "cmbClase")
-    logger.info(
-        f"Found {len(classes)} classes for type ID: {type_id}, segment ID: {segment_id}, family ID: {family_id}"
-    )
-    return classes
+    return _default_session.obtain_classes(type_id, segment_id, family_id)
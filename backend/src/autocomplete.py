@@ -0,0 +1,183 @@
+"""
+Autocompletado por prefijo sobre el índice FTS5, con corrección de errores de
+dedo (distancia de edición 1) cuando el prefijo no encuentra nada
+"""
+
+import bisect
+import logging
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+from session import with_db
+from src.normalize import tokenize
+from src.metrics import FTS_QUERY_DURATION, FTS_QUERY_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+AUTOCOMPLETE_COLUMNS = ["c_ClaveProdServ", "Descripcion", "Clase"]
+
+# Longitudes de prefijo que también se indexan para corregir palabras a medio escribir
+MIN_TYPO_PREFIX = 3
+MAX_TYPO_PREFIX = 7
+MAX_EDIT_DISTANCE = 1
+# Se califica con bm25 todo el conjunto que coincide y se devuelven las mejores
+# :limit filas; los empates se rompen por rowid (clave) para que el orden sea estable
+_AUTOCOMPLETE_SQL = text("""
+    SELECT s.c_ClaveProdServ, s.Descripcion, s.Clase
+    FROM clave_prod_serv_fts
+    JOIN clave_prod_serv_search s ON s.clave_num = clave_prod_serv_fts.rowid
+    WHERE clave_prod_serv_fts MATCH :match AND s.Clase_num IS NOT NULL
+    ORDER BY bm25(clave_prod_serv_fts), clave_prod_serv_fts.rowid
+    LIMIT :limit
+""")
+
+
+def _deletes(word: str):
+    return {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _osa_distance(a: str, b: str, max_distance: int) -> int:
+    """Distancia de edición con transposiciones; corta en cuanto supera max_distance."""
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+class SpellingIndex:
+    """
+    Índice de borrados (estilo SymSpell) sobre el vocabulario del índice FTS: dos
+    cadenas a distancia 1 comparten al menos una variante con una letra borrada,
+    así que cada corrección cuesta unas cuantas búsquedas en un dict.
+    """
+
+    def __init__(self, vocabulary: Dict[str, int]):
+        self.words = vocabulary
+        self._sorted_words = sorted(vocabulary)
+        # prefijo -> documentos que contienen alguna palabra que empieza así
+        self.prefixes: Dict[str, int] = defaultdict(int)
+        for word, docs in vocabulary.items():
+            for length in range(MIN_TYPO_PREFIX, min(len(word), MAX_TYPO_PREFIX) + 1):
+                self.prefixes[word[:length]] += docs
+        self._candidates = defaultdict(list)
+        for key in vocabulary.keys() | self.prefixes.keys():
+            self._candidates[key].append(key)
+            for deleted in _deletes(key):
+                self._candidates[deleted].append(key)
+
+    def has_prefix(self, token: str) -> bool:
+        i = bisect.bisect_left(self._sorted_words, token)
+        return i < len(self._sorted_words) and self._sorted_words[i].startswith(token)
+
+    def correct(self, token: str, prefix: bool = False) -> Optional[str]:
+        """Palabra (o prefijo, si prefix=True) más frecuente a distancia <= MAX_EDIT_DISTANCE."""
+        weights = self.prefixes if prefix else {}
+        best, best_rank = None, None
+        for key in {token} | _deletes(token):
+            for candidate in self._candidates.get(key, ()):
+                docs = self.words.get(candidate) or weights.get(candidate)
+                if not docs:
+                    continue
+                distance = _osa_distance(token, candidate, MAX_EDIT_DISTANCE)
+                if distance > MAX_EDIT_DISTANCE:
+                    continue
+                rank = (distance, -docs, candidate)
+                if best_rank is None or rank < best_rank:
+                    best, best_rank = candidate, rank
+        return best
+
+    def correct_tokens(self, tokens: List[str]) -> List[str]:
+        """
+        Corrige las palabras completas y el último token como prefijo; las palabras
+        que no están en el índice ni tienen corrección se descartan.
+        """
+        corrected = []
+        for word in tokens[:-1]:
+            word = word if word in self.words else self.correct(word)
+            if word:
+                corrected.append(word)
+        last = tokens[-1]
+        if not self.has_prefix(last):
+            last = self.correct(last, prefix=True)
+        return corrected + [last] if last else corrected
+
+
+_spelling_lock = threading.Lock()
+_spelling_index = (None, None)
+
+
+@with_db
+def get_spelling_index(*, db) -> SpellingIndex:
+    """Índice de corrección del snapshot que atiende esta sesión; se construye una vez por snapshot."""
+    global _spelling_index
+    key = str(db.get_bind().url)
+    with _spelling_lock:
+        if _spelling_index[0] == key:
+            return _spelling_index[1]
+        try:
+            vocabulary = dict(db.execute(text("SELECT term, doc FROM clave_prod_serv_vocab")).fetchall())
+        except Exception as e:
+            logger.warning(f"No FTS vocabulary in this database, typo correction disabled: {e}")
+            db.rollback()
+            vocabulary = {}
+        _spelling_index = (key, SpellingIndex(vocabulary))
+        logger.info(f"Built spelling index with {len(vocabulary)} terms")
+        return _spelling_index[1]
+
+
+def compile_prefix_query(tokens: List[str]) -> str:
+    """Todas las palabras deben aparecer; la última puede estar a medio escribir."""
+    return " ".join(f'"{token}"' for token in tokens) + "*"
+
+
+def _prefix_search(tokens, limit, db):
+    with FTS_QUERY_DURATION.labels(kind="autocomplete").time():
+        rows = db.execute(
+            _AUTOCOMPLETE_SQL,
+            {"match": compile_prefix_query(tokens), "limit": limit},
+        ).fetchall()
+    return [dict(zip(AUTOCOMPLETE_COLUMNS, row)) for row in rows]
+
+
+@with_db
+def autocomplete(q, limit=10, *, db):
+    """
+    Sugerencias para búsqueda mientras se escribe.
+
+    Returns:
+        dict: results con las mejores coincidencias y corrected con la búsqueda
+        corregida cuando hubo que tolerar errores de dedo (None si no).
+    """
+    tokens = tokenize(q)
+    if not tokens:
+        return {"corrected": None, "results": []}
+
+    try:
+        results = _prefix_search(tokens, limit, db)
+        corrected = None
+        if not results:
+            fixed = get_spelling_index(db=db).correct_tokens(tokens)
+            if fixed and fixed != tokens:
+                results = _prefix_search(fixed, limit, db)
+                corrected = " ".join(fixed)
+    except Exception as e:
+        FTS_QUERY_ERRORS.labels(kind="autocomplete").inc()
+        logger.error(f"Autocomplete failed for {q!r}: {e}")
+        db.rollback()
+        return {"corrected": None, "results": []}
+
+    return {"corrected": corrected, "results": results}
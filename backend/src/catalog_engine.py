@@ -0,0 +1,281 @@
+"""
+Motor en memoria (opcional) para consultas por clave y búsquedas de texto sobre
+c_ClaveProdServ, sin pasar por SQLite ni por el ORM.
+
+Se activa con CATALOG_ENGINE=memory. Carga el parquet del catálogo del snapshot
+vigente en columnas de numpy ordenadas por clave (búsqueda binaria con
+searchsorted), une cada producto con su Clase por posición y guarda los textos
+repetidos (Tipo, Division, Grupo, Clase, Incluir_*, fechas) una sola vez como categorías.
+Las búsquedas de texto usan un índice invertido palabra -> filas y el mismo bm25
+(k1=1.2, b=0.75) y boost de frase que la consulta FTS5.
+"""
+
+import os
+import math
+import time
+import logging
+import threading
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from db import Classification
+from session import with_db
+from src.normalize import searchable_text, tokenize
+from src.search import PHRASE_BOOST, SEARCH_COLUMNS
+from src.lookup import CLASSIFICATION_COLUMNS, PRODUCT_COLUMNS, normalize_code
+from src.catalogo_pull import CATALOG_COLUMNS, CATALOG_DIR
+from src.metrics import FTS_QUERY_DURATION, LOADER_PHASE_DURATION, LOADER_ROWS
+
+
+logger = logging.getLogger(__name__)
+
+# "sqlite" (por defecto) o "memory"
+CATALOG_ENGINE = os.environ.get("CATALOG_ENGINE", "sqlite")
+
+# Parámetros por defecto de bm25() en FTS5
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Columnas de texto con pocos valores distintos: se guardan como índice a una lista de valores
+_CATEGORY_COLUMNS = [
+    "Incluir_IVA_trasladado",
+    "Incluir_IEPS_trasladado",
+    "Complemento_que_debe_incluir",
+    "Estimulo_Franja_Fronteriza",
+]
+_DATE_COLUMNS = ["FechaInicioVigencia", "FechaFinVigencia"]
+_CLASS_NAME_COLUMNS = ["Tipo", "Division", "Grupo", "Clase"]
+
+
+class _Categories:
+    """Columna de texto como códigos enteros más la lista de valores distintos (None = código -1)."""
+
+    def __init__(self, values):
+        categorical = pd.Categorical(values)
+        self.codes = categorical.codes
+        self.values = [str(value) for value in categorical.categories]
+
+    def __getitem__(self, position: int) -> Optional[str]:
+        code = self.codes[position]
+        return None if code < 0 else self.values[code]
+
+
+def _objects(column: pd.Series) -> np.ndarray:
+    # Los nulos de pandas/numpy como None, igual que los devuelve SQLite
+    return column.astype(object).where(column.notna(), None).to_numpy(dtype=object)
+
+
+def _format_dates(column: pd.Series) -> pd.Series:
+    # Mismo texto que guarda el tipo DateTime de SQLAlchemy y devuelven las consultas con text()
+    return pd.to_datetime(column, errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S.%f")
+
+
+class CatalogEngine:
+    def __init__(self, catalog: pd.DataFrame, classification: List[Dict[str, Any]]):
+        catalog = catalog[catalog["c_ClaveProdServ"].notna()]
+        catalog = catalog.assign(c_ClaveProdServ=catalog["c_ClaveProdServ"].astype("int64"))
+        catalog = catalog.sort_values("c_ClaveProdServ", kind="stable").drop_duplicates("c_ClaveProdServ")
+
+        self.codes = catalog["c_ClaveProdServ"].to_numpy(dtype=np.int64)
+        self.descriptions = _objects(catalog["Descripcion"])
+        self.similar_words = _objects(catalog["Palabras_similares"])
+        self.categories = {column: _Categories(catalog[column]) for column in _CATEGORY_COLUMNS}
+        for column in _DATE_COLUMNS:
+            # Pocas fechas distintas: también como categorías, ya con el texto que devuelve SQLite
+            self.categories[column] = _Categories(_format_dates(catalog[column]))
+
+        # Clasificación ordenada por Clase_num, con cada nombre guardado una sola vez;
+        # cada producto guarda la posición de su Clase (o -1) y la unión es indexar una lista
+        classification = sorted(classification, key=lambda row: row["Clase_num"])
+        names = {column: _Categories([row[column] for row in classification]) for column in _CLASS_NAME_COLUMNS}
+        self.class_rows = [
+            tuple(names[column][i] if column in names else row[column] for column in CLASSIFICATION_COLUMNS)
+            for i, row in enumerate(classification)
+        ]
+        clase_nums = np.array([row["Clase_num"] for row in classification], dtype=np.int64)
+        wanted = self.codes // 100
+        positions = np.searchsorted(clase_nums, wanted)
+        positions = np.minimum(positions, max(len(clase_nums) - 1, 0))
+        found = (clase_nums[positions] == wanted) if len(clase_nums) else np.zeros(len(wanted), dtype=bool)
+        self.class_positions = np.where(found, positions, -1).astype(np.int32)
+
+        self._build_text_index(searchable_text(catalog["Descripcion"], catalog["Palabras_similares"]))
+
+    def _build_text_index(self, combined: pd.Series) -> None:
+        postings: Dict[str, Tuple[List[int], List[int]]] = {}
+        lengths = np.zeros(len(self.codes), dtype=np.int32)
+        self._tokens: List[Tuple[str, ...]] = []
+        for position, text in enumerate(combined):
+            tokens = tuple(tokenize(text)) if isinstance(text, str) else ()
+            self._tokens.append(tokens)
+            lengths[position] = len(tokens)
+            for token, count in Counter(tokens).items():
+                rows, counts = postings.setdefault(token, ([], []))
+                rows.append(position)
+                counts.append(count)
+        self.doc_lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+        self.postings = {
+            token: (np.array(rows, dtype=np.int32), np.array(counts, dtype=np.float64))
+            for token, (rows, counts) in postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def _bm25(self, rows: np.ndarray, counts: np.ndarray, scores: np.ndarray) -> None:
+        # Mismas fórmulas que fts5_bm25: idf con piso de 1e-6 y normalización por longitud
+        total = len(self.codes)
+        idf = math.log((total - len(rows) + 0.5) / (len(rows) + 0.5))
+        idf = max(idf, 1e-6)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_lengths[rows] / self.average_length)
+        scores[rows] += idf * counts * (BM25_K1 + 1) / (counts + norm)
+
+    def _phrase_counts(self, phrase: Tuple[str, ...], rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        size = len(phrase)
+        found_rows, found_counts = [], []
+        for position in rows:
+            tokens = self._tokens[position]
+            count = sum(1 for i in range(len(tokens) - size + 1) if tokens[i:i + size] == phrase)
+            if count:
+                found_rows.append(position)
+                found_counts.append(count)
+        return np.array(found_rows, dtype=np.int32), np.array(found_counts, dtype=np.float64)
+
+    def search_rows(self, q: str, limit: int = 50, offset: int = 0) -> List[tuple]:
+        """Igual que search.search_rows: tuplas en el orden de SEARCH_COLUMNS."""
+        tokens = tokenize(q)
+        words = [word for word in dict.fromkeys(tokens) if word in self.postings]
+        if not words:
+            return []
+
+        scores = np.zeros(len(self.codes), dtype=np.float64)
+        for word in words:
+            self._bm25(*self.postings[word], scores)
+        if len(tokens) > 1 and len(words) == len(set(tokens)):
+            # La frase completa cuenta como un término más y además recibe PHRASE_BOOST
+            candidates = self.postings[words[0]][0]
+            for word in words[1:]:
+                candidates = np.intersect1d(candidates, self.postings[word][0], assume_unique=True)
+            phrase_rows, phrase_counts = self._phrase_counts(tuple(tokens), candidates)
+            if len(phrase_rows):
+                self._bm25(phrase_rows, phrase_counts, scores)
+                scores[phrase_rows] += PHRASE_BOOST
+
+        hits = np.nonzero(scores)[0]
+        hits = hits[self.class_positions[hits] >= 0]
+        # Orden estable: a igual puntaje gana la clave menor, como el rowid en SQLite
+        hits = hits[np.argsort(-scores[hits], kind="stable")][offset:offset + limit]
+        return self.rows(hits, SEARCH_COLUMNS)
+
+    def _column(self, column: str, positions: np.ndarray) -> List[Any]:
+        if column == "c_ClaveProdServ":
+            return [str(code) for code in self.codes[positions].tolist()]
+        if column == "Descripcion":
+            return self.descriptions[positions].tolist()
+        if column == "Palabras_similares":
+            return self.similar_words[positions].tolist()
+        values = self.categories[column].values
+        return [None if code < 0 else values[code] for code in self.categories[column].codes[positions].tolist()]
+
+    def rows(self, positions: np.ndarray, columns: List[str]) -> List[tuple]:
+        """Filas de las posiciones dadas como tuplas; se arma columna por columna, no fila por fila."""
+        if any(column in CLASSIFICATION_COLUMNS for column in columns):
+            missing = (None,) * len(CLASSIFICATION_COLUMNS)
+            class_rows = [
+                self.class_rows[i] if i >= 0 else missing for i in self.class_positions[positions].tolist()
+            ]
+        values = []
+        for column in columns:
+            if column in CLASSIFICATION_COLUMNS:
+                index = CLASSIFICATION_COLUMNS.index(column)
+                values.append([row[index] for row in class_rows])
+            else:
+                values.append(self._column(column, positions))
+        return list(zip(*values))
+
+    def find(self, codes: List[int]) -> np.ndarray:
+        """Posición de cada clave en el catálogo, o -1 si no existe."""
+        wanted = np.asarray(codes, dtype=np.int64)
+        positions = np.searchsorted(self.codes, wanted)
+        positions = np.minimum(positions, max(len(self.codes) - 1, 0))
+        found = self.codes[positions] == wanted if len(self.codes) else np.zeros(len(wanted), dtype=bool)
+        return np.where(found, positions, -1)
+
+    def lookup_codes(self, codes: List) -> List[Dict]:
+        """Igual que lookup.lookup_codes, con una búsqueda binaria por clave."""
+        keys = [normalize_code(code) for code in codes]
+        # Claves fuera del rango de int64 no pueden existir
+        numbers = [int(key) if key is not None and len(key) < 19 else -1 for key in keys]
+        positions = self.find(numbers)
+        found = positions[positions >= 0]
+        products = iter(self.rows(found, PRODUCT_COLUMNS))
+        class_positions = iter(self.class_positions[found].tolist())
+
+        results = []
+        for code, position in zip(codes, positions.tolist()):
+            product, classification = None, None
+            if position >= 0:
+                product = dict(zip(PRODUCT_COLUMNS, next(products)))
+                class_position = next(class_positions)
+                if class_position >= 0:
+                    classification = dict(zip(CLASSIFICATION_COLUMNS, self.class_rows[class_position]))
+            results.append({
+                "code": code,
+                "found": product is not None,
+                "product": product,
+                "classification": classification,
+            })
+        return results
+
+    def lookup_queries(self, queries: List[str], limit: int = 5) -> List[Dict]:
+        results = {
+            q: [dict(zip(SEARCH_COLUMNS, row)) for row in self.search_rows(q, limit=limit)]
+            for q in dict.fromkeys(queries)
+        }
+        return [{"q": q, "results": results[q]} for q in queries]
+
+
+def _catalog_frame(catalog_date: str) -> pd.DataFrame:
+    # El parquet lo genera la carga del snapshot; aquí solo se lee, nunca se convierte el XLS
+    parquet_path = os.path.join(CATALOG_DIR, f"catalogo_{catalog_date}.parquet")
+    if not os.path.isfile(parquet_path):
+        raise FileNotFoundError(
+            f"Parquet {parquet_path} for the served snapshot is missing, run /load_db to rebuild it"
+        )
+    # Combined se vuelve a calcular; los parquet anteriores lo guardaban con otro formato
+    return pd.read_parquet(parquet_path, columns=CATALOG_COLUMNS[:-1])
+
+
+_engine_lock = threading.Lock()
+_engine = (None, None)
+
+
+@with_db
+def get_catalog_engine(catalog_date: str, *, db) -> CatalogEngine:
+    """Motor del snapshot que atiende esta sesión; se construye una vez por snapshot."""
+    global _engine
+    key = str(db.get_bind().url)
+    with _engine_lock:
+        if _engine[0] == key:
+            return _engine[1]
+        start = time.perf_counter()
+        with LOADER_PHASE_DURATION.labels(phase="memory_engine").time():
+            classification = [dict(row._mapping) for row in db.execute(select(Classification.__table__))]
+            engine = CatalogEngine(_catalog_frame(catalog_date), classification)
+        _engine = (key, engine)
+        LOADER_ROWS.labels(table="catalog_engine").set(len(engine))
+        logger.info(
+            f"Built in-memory catalog engine for {catalog_date}: {len(engine)} rows, "
+            f"{len(engine.postings)} terms in {time.perf_counter() - start:.2f}s"
+        )
+        return engine
+
+
+def search_rows_in_memory(engine: CatalogEngine, q: str, limit: int = 50, offset: int = 0) -> List[tuple]:
+    with FTS_QUERY_DURATION.labels(kind="memory_search").time():
+        return engine.search_rows(q, limit=limit, offset=offset)
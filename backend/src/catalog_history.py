@@ -0,0 +1,281 @@
+"""
+Historial de versiones del catálogo c_ClaveProdServ en una sola tabla, para
+consultar qué claves estaban vigentes en una fecha (as_of).
+
+Cada versión se compara con la anterior: las filas sin cambios solo extienden
+last_version, y las modificadas o eliminadas cierran su intervalo el día antes
+de la nueva versión. El intervalo vigente de cada fila queda en valid_from y
+valid_to; un intervalo vacío (valid_from > valid_to) no coincide con ninguna fecha.
+"""
+
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+from session import with_db
+from db import ClaveProdServHistory, CatalogHistoryVersion
+from src.normalize import FTS_TOKENIZER
+from src.metrics import LOADER_PHASE_DURATION, LOADER_ROWS
+
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TABLE = ClaveProdServHistory.__tablename__
+HISTORY_FTS_TABLE = "clave_prod_serv_history_fts"
+
+# Fechas como enteros YYYYMMDD, comparables directamente
+OPEN_START = 0
+OPEN_END = 99991231
+
+_HISTORY_FTS_SQL = (
+    f"CREATE VIRTUAL TABLE {HISTORY_FTS_TABLE} "
+    f"USING fts5(Combined, c_ClaveProdServ UNINDEXED, content='{HISTORY_TABLE}', "
+    f"content_rowid='id', tokenize='{FTS_TOKENIZER}', prefix='2 3 4')"
+)
+
+# Columnas que definen si una fila cambió; Combined se deriva de Descripcion y Palabras_similares
+_CONTENT_COLUMNS = [
+    "c_ClaveProdServ",
+    "Descripcion",
+    "Incluir_IVA_trasladado",
+    "Incluir_IEPS_trasladado",
+    "Complemento_que_debe_incluir",
+    "FechaInicioVigencia",
+    "FechaFinVigencia",
+    "Estimulo_Franja_Fronteriza",
+    "Palabras_similares",
+]
+_INSERT_COLUMNS = ["id"] + _CONTENT_COLUMNS + [
+    "Combined", "row_hash", "valid_from", "valid_to", "first_version", "last_version",
+]
+_INSERT_SQL = text(
+    f"INSERT INTO {HISTORY_TABLE} ({', '.join(_INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join(':' + column for column in _INSERT_COLUMNS)})"
+)
+
+
+def day_number(value) -> Optional[int]:
+    """date/datetime -> 20250101; None se queda como None."""
+    if value is None:
+        return None
+    return value.year * 10000 + value.month * 100 + value.day
+
+
+def _previous_day(date_str: str) -> int:
+    return day_number(datetime.strptime(date_str, "%Y%m%d").date() - timedelta(days=1))
+
+
+def _stored(value):
+    # Mismo formato que usa el tipo DateTime de SQLAlchemy en SQLite
+    return value.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(value, datetime) else value
+
+
+def _row_hash(record: Dict[str, Any]) -> str:
+    content = "\x1f".join("" if record.get(c) is None else str(record.get(c)) for c in _CONTENT_COLUMNS)
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@with_db
+def create_history_tables(*, db) -> bool:
+    """
+    Crea el FTS del historial si no existe o si cambió su definición.
+
+    Returns:
+        bool: True si el FTS se (re)creó y hay que reconstruirlo con 'rebuild'.
+    """
+    # Los snapshots anteriores copiados en modo diff traen un R*Tree de intervalos que ya no se usa
+    db.execute(text("DROP TABLE IF EXISTS clave_prod_serv_history_validity"))
+    current = db.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": HISTORY_FTS_TABLE},
+    ).scalar()
+    if current == _HISTORY_FTS_SQL:
+        db.commit()
+        return False
+    if current is not None:
+        logger.info(f"FTS index definition changed, recreating {HISTORY_FTS_TABLE}")
+        db.execute(text(f"DROP TABLE {HISTORY_FTS_TABLE}"))
+    db.execute(text(_HISTORY_FTS_SQL))
+    db.commit()
+    return True
+
+
+@with_db
+def history_versions(*, db) -> List[str]:
+    """Versiones (YYYYMMDD) ya aplicadas al historial, de la más antigua a la más reciente; [] si no hay historial."""
+    try:
+        rows = db.execute(text(f"SELECT version FROM {CatalogHistoryVersion.__tablename__} ORDER BY version"))
+        return [row[0] for row in rows]
+    except Exception:
+        # Snapshots construidos antes de que existiera el historial
+        db.rollback()
+        return []
+
+
+@with_db
+def copy_history(source_path: str, *, db) -> bool:
+    """
+    Copia el historial de otro snapshot (normalmente el vigente) a la base de db,
+    para que una carga completa solo tenga que aplicar las versiones nuevas en
+    lugar de volver a leer todas las anteriores.
+
+    El FTS del historial no se copia; update_history lo reconstruye con 'rebuild'.
+
+    Returns:
+        bool: False si el snapshot no tiene historial.
+    """
+    db.commit()
+    db.execute(text("ATTACH DATABASE :path AS previous"), {"path": source_path})
+    try:
+        tables = {
+            row[0] for row in db.execute(text("SELECT name FROM previous.sqlite_master WHERE type = 'table'"))
+        }
+        if not {HISTORY_TABLE, CatalogHistoryVersion.__tablename__} <= tables:
+            return False
+        columns = ", ".join(_INSERT_COLUMNS)
+        db.execute(text(f"INSERT INTO main.{HISTORY_TABLE} ({columns}) SELECT {columns} FROM previous.{HISTORY_TABLE}"))
+        db.execute(
+            text(
+                f"INSERT INTO main.{CatalogHistoryVersion.__tablename__} "
+                f"SELECT * FROM previous.{CatalogHistoryVersion.__tablename__}"
+            )
+        )
+        db.commit()
+        return True
+    finally:
+        db.rollback()
+        db.execute(text("DETACH DATABASE previous"))
+
+
+def _clear_history(db) -> None:
+    db.execute(text(f"DELETE FROM {HISTORY_TABLE}"))
+    db.execute(text(f"INSERT INTO {HISTORY_FTS_TABLE}({HISTORY_FTS_TABLE}) VALUES('delete-all')"))
+    db.execute(text(f"DELETE FROM {CatalogHistoryVersion.__tablename__}"))
+
+
+def _apply_version(version: str, records: List[Dict[str, Any]], previous: Optional[str], *, db) -> Dict[str, int]:
+    # Filas vigentes en la versión anterior: clave -> (id, hash, valid_from, valid_to)
+    current = {}
+    seen = set()
+    if previous is not None:
+        seen = {row[0] for row in db.execute(text(f"SELECT DISTINCT c_ClaveProdServ FROM {HISTORY_TABLE}"))}
+        for row in db.execute(
+            text(
+                f"SELECT id, c_ClaveProdServ, row_hash, valid_from, valid_to FROM {HISTORY_TABLE} "
+                "WHERE last_version = :previous"
+            ),
+            {"previous": previous},
+        ):
+            current[row.c_ClaveProdServ] = (row.id, row.row_hash, row.valid_from, row.valid_to)
+
+    next_id = (db.execute(text(f"SELECT MAX(id) FROM {HISTORY_TABLE}")).scalar() or 0) + 1
+    close_at = _previous_day(version)
+    unchanged, closed, inserted = [], [], []
+    incoming = set()
+    for record in records:
+        code = record["c_ClaveProdServ"]
+        incoming.add(code)
+        row_hash = _row_hash(record)
+        existing = current.get(code)
+        if existing is not None and existing[1] == row_hash:
+            unchanged.append({"id": existing[0], "version": version})
+            continue
+        if existing is not None:
+            closed.append(existing)
+        valid_from = day_number(record.get("FechaInicioVigencia")) or OPEN_START
+        if code in seen:
+            # La versión nueva reemplaza a la anterior a partir de su fecha de publicación
+            valid_from = max(valid_from, day_number(datetime.strptime(version, "%Y%m%d")))
+        valid_to = day_number(record.get("FechaFinVigencia")) or OPEN_END
+        inserted.append({
+            **{column: _stored(record.get(column)) for column in _CONTENT_COLUMNS},
+            "id": next_id,
+            "Combined": record.get("Combined"),
+            "row_hash": row_hash,
+            "valid_from": valid_from,
+            "valid_to": valid_to,
+            "first_version": version,
+            "last_version": version,
+        })
+        next_id += 1
+    removed = [row for code, row in current.items() if code not in incoming]
+
+    if unchanged:
+        db.execute(text(f"UPDATE {HISTORY_TABLE} SET last_version = :version WHERE id = :id"), unchanged)
+    if closed or removed:
+        db.execute(
+            text(f"UPDATE {HISTORY_TABLE} SET valid_to = :valid_to WHERE id = :id"),
+            [{"id": row_id, "valid_to": min(valid_to, close_at)} for row_id, _, _, valid_to in closed + removed],
+        )
+    if inserted:
+        db.execute(_INSERT_SQL, inserted)
+        db.execute(
+            text(
+                f"INSERT INTO {HISTORY_FTS_TABLE}(rowid, Combined, c_ClaveProdServ) "
+                "VALUES (:id, :Combined, :c_ClaveProdServ)"
+            ),
+            inserted,
+        )
+
+    stats = {
+        "rows": len(records),
+        "added": len([row for row in inserted if row["c_ClaveProdServ"] not in current]),
+        "changed": len(closed),
+        "removed": len(removed),
+    }
+    db.execute(
+        CatalogHistoryVersion.__table__.insert(),
+        {"version": version, "applied_at": datetime.now(), **stats},
+    )
+    return stats
+
+
+@with_db
+def update_history(versions: List[str], load_records: Callable[[str], List[Dict[str, Any]]], *, db) -> Dict[str, Any]:
+    """
+    Agrega al historial las versiones que aún no tiene.
+
+    Si el historial ya contiene una versión más nueva que alguna de las pedidas
+    (por ejemplo al cargar una versión anterior), se reconstruye desde cero. Si
+    solo cambió la definición del FTS, se reindexa el historial que ya existe.
+
+    Args:
+        versions: Fechas YYYYMMDD a incluir, de la más antigua a la más reciente.
+        load_records: load_records(fecha) devuelve las filas ya limpias de esa versión.
+
+    Returns:
+        Dict: Versiones en el historial, cuáles se aplicaron ahora y filas guardadas.
+    """
+    fts_created = create_history_tables(db=db)
+    applied = history_versions(db=db)
+    pending = [version for version in versions if version not in applied]
+    out_of_order = applied and versions and (
+        applied[-1] > versions[-1] or (pending and pending[0] < applied[-1])
+    )
+    if out_of_order:
+        logger.info("Rebuilding catalog history from scratch")
+        _clear_history(db)
+        applied, pending = [], list(versions)
+    elif fts_created and applied:
+        with LOADER_PHASE_DURATION.labels(phase="history_fts").time():
+            db.execute(text(f"INSERT INTO {HISTORY_FTS_TABLE}({HISTORY_FTS_TABLE}) VALUES('rebuild')"))
+
+    with LOADER_PHASE_DURATION.labels(phase="history").time():
+        previous = applied[-1] if applied else None
+        for version in pending:
+            try:
+                records = load_records(version)
+            except FileNotFoundError as e:
+                logger.warning(f"Skipping catalog version {version} in history: {e}")
+                continue
+            stats = _apply_version(version, records, previous, db=db)
+            logger.info(f"Applied catalog version {version} to history: {stats}")
+            previous = version
+        db.commit()
+
+    count = db.execute(text(f"SELECT COUNT(*) FROM {HISTORY_TABLE}")).scalar()
+    LOADER_ROWS.labels(table=HISTORY_TABLE).set(count)
+    return {"versions": history_versions(db=db), "applied": pending, "rows": count}
+
@@ -0,0 +1,176 @@
+"""
+Registro de versiones del catálogo CFDI (una por fecha de publicación del SAT) y
+descubrimiento de la más reciente probando fechas candidatas en paralelo
+"""
+
+import os
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+import requests
+
+from src.file_lock import replace_atomically
+
+
+logger = logging.getLogger(__name__)
+
+DATE_FORMAT = "%Y%m%d"
+REGISTRY_FILENAME = "catalog_versions.json"
+# Hasta cuántos días hacia atrás se prueban fechas candidatas
+DISCOVERY_DAYS = int(os.environ.get("CATALOG_DISCOVERY_DAYS", "120"))
+DISCOVERY_WORKERS = int(os.environ.get("CATALOG_DISCOVERY_WORKERS", "8"))
+PROBE_TIMEOUT = (5, 15)
+
+_lock = threading.Lock()
+
+
+def parse_catalog_date(date_str: str) -> date:
+    """'20250101' -> date(2025, 1, 1); ValueError si no es una fecha válida."""
+    return datetime.strptime(date_str, DATE_FORMAT).date()
+
+
+def xls_filename(date_str: str) -> str:
+    return f"catCFDI_V_4_{date_str}.xls"
+
+
+def _registry_path(catalog_dir: str) -> str:
+    return os.path.join(catalog_dir, REGISTRY_FILENAME)
+
+
+def _scan_directory(catalog_dir: str) -> Dict[str, Dict[str, Any]]:
+    # Solo para instalaciones anteriores al registro: reconstruirlo una vez a partir de los archivos
+    versions = {}
+    for name in os.listdir(catalog_dir):
+        for prefix, suffix, kind in (("catCFDI_V_4_", ".xls", "xls"), ("catalogo_", ".parquet", "parquet")):
+            if name.startswith(prefix) and name.endswith(suffix):
+                date_str = name[len(prefix):-len(suffix)]
+                try:
+                    parse_catalog_date(date_str)
+                except ValueError:
+                    continue
+                entry = versions.setdefault(date_str, {"date": date_str})
+                entry[kind] = os.path.join(catalog_dir, name)
+    return versions
+
+
+def _read(catalog_dir: str) -> Dict[str, Dict[str, Any]]:
+    path = _registry_path(catalog_dir)
+    if not os.path.isfile(path):
+        versions = _scan_directory(catalog_dir) if os.path.isdir(catalog_dir) else {}
+        if versions:
+            _save(catalog_dir, versions)
+            logger.info(f"Built catalog version registry from {len(versions)} files in {catalog_dir}")
+        return versions
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable catalog version registry {path}: {e}")
+        return {}
+
+
+def load_versions(catalog_dir: str) -> Dict[str, Dict[str, Any]]:
+    """Versiones conocidas: fecha (YYYYMMDD) -> rutas de su XLS y parquet, y tamaño, mtime y sha256 del XLS."""
+    with _lock:
+        return _read(catalog_dir)
+
+
+def _save(catalog_dir: str, versions: Dict[str, Dict[str, Any]]) -> None:
+    path = _registry_path(catalog_dir)
+    with replace_atomically(path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(versions, f, indent=2, sort_keys=True)
+
+
+def register_version(catalog_dir: str, date_str: str, **fields: Any) -> Dict[str, Any]:
+    """Agrega o actualiza la versión date_str con los campos dados (xls, parquet, xls_sha256...)."""
+    parse_catalog_date(date_str)
+    with _lock:
+        versions = _read(catalog_dir)
+        entry = versions.setdefault(date_str, {"date": date_str})
+        entry.update(fields)
+        entry["registered_at"] = datetime.now().isoformat()
+        _save(catalog_dir, versions)
+    return entry
+
+
+def latest_version(catalog_dir: str) -> Optional[str]:
+    versions = load_versions(catalog_dir)
+    if not versions:
+        return None
+    return max(versions, key=parse_catalog_date)
+
+
+def resolve_version(catalog_dir: str, version: str = "latest") -> str:
+    """
+    Fecha de la versión pedida: "latest" o una fecha YYYYMMDD ya registrada.
+
+    Raises:
+        FileNotFoundError: Si no hay versiones o la fecha no está registrada.
+    """
+    if version == "latest":
+        date_str = latest_version(catalog_dir)
+        if date_str is None:
+            raise FileNotFoundError("No catalog files found")
+        return date_str
+    if version not in load_versions(catalog_dir):
+        raise FileNotFoundError(f"Catalog version {version} is not downloaded")
+    return version
+
+
+def probe_date(base_url: str, date_str: str, session: Optional[requests.Session] = None) -> bool:
+    """True si el SAT publica un catálogo con esa fecha."""
+    url = f"{base_url}/{xls_filename(date_str)}"
+    http = session or requests
+    response = http.head(url, timeout=PROBE_TIMEOUT, allow_redirects=True)
+    if response.status_code in (405, 501):
+        # Servidores que no aceptan HEAD: GET sin leer el cuerpo
+        with http.get(url, timeout=PROBE_TIMEOUT, stream=True) as response:
+            pass
+    return response.status_code == 200
+
+
+def discover_latest(
+    base_url: str,
+    since: Optional[str] = None,
+    until: Optional[date] = None,
+    workers: int = DISCOVERY_WORKERS,
+) -> Optional[str]:
+    """
+    Busca la publicación más reciente probando cada fecha desde since (exclusiva)
+    hasta hoy, como máximo DISCOVERY_DAYS días hacia atrás.
+
+    Las fechas se prueban en paralelo; la más reciente que exista gana.
+
+    Returns:
+        Optional[str]: Fecha YYYYMMDD encontrada, o None si no hay nada más nuevo que since.
+    """
+    until = until or date.today()
+    start = until - timedelta(days=DISCOVERY_DAYS)
+    if since:
+        start = max(start, parse_catalog_date(since) + timedelta(days=1))
+    candidates = [
+        (start + timedelta(days=offset)).strftime(DATE_FORMAT)
+        for offset in range((until - start).days + 1)
+    ]
+    if not candidates:
+        return None
+
+    local = threading.local()
+
+    def probe(date_str: str) -> bool:
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        try:
+            return probe_date(base_url, date_str, local.session)
+        except requests.RequestException as e:
+            logger.warning(f"Probe for catalog {date_str} failed: {e}")
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="probe") as pool:
+        found = [d for d, exists in zip(candidates, pool.map(probe, candidates)) if exists]
+    logger.info(f"Probed {len(candidates)} candidate dates from {candidates[0]}, found {found}")
+    return max(found, key=parse_catalog_date) if found else None
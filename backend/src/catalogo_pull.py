@@ -1,124 +1,366 @@
 import os
+import time
 import logging
+import resource
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import requests
 from datetime import datetime
 from session import with_db
 from db import ClaveProdServ
-import unicodedata
+from src.search import build_search_table
+from src.fts_index import build_fts_index
+from src.normalize import FTS_TOKENIZER
+from src.normalize import searchable_text
+from src.metrics import LOADER_PHASE_DURATION, LOADER_ROWS
+from src.download import download_file, file_sha256, DownloadError, NotFound
+from src.catalog_versions import discover_latest, latest_version, parse_catalog_date
+from src.catalog_versions import load_versions, register_version, resolve_version
+from src.catalog_history import update_history
+from src.file_lock import replace_atomically
 
 from sqlalchemy import text
+from sqlalchemy import select
 
 
 logger = logging.getLogger(__name__)
 
+CATALOG_DIR = "/app"
+SAT_CATALOG_URL = os.environ.get(
+    "SAT_CATALOG_URL", "http://omawww.sat.gob.mx/tramitesyservicios/Paginas/documentos"
+)
+# Versiones del catálogo que se guardan en el historial (consultas con as_of)
+HISTORY_VERSIONS = int(os.environ.get("CATALOG_HISTORY_VERSIONS", "12"))
+# Firma de los archivos OLE2 (.xls de Excel 97-2003)
+XLS_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+CATALOG_COLUMNS = [
+    'c_ClaveProdServ',
+    'Descripcion',
+    'Incluir_IVA_trasladado',
+    'Incluir_IEPS_trasladado',
+    'Complemento_que_debe_incluir',
+    'FechaInicioVigencia',
+    'FechaFinVigencia',
+    'Estimulo_Franja_Fronteriza',
+    'Palabras_similares',
+    'Combined',
+]
+
+
+_FTS_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE clave_prod_serv_fts "
+    "USING fts5(Combined, c_ClaveProdServ UNINDEXED, content='clave_prod_serv', "
+    f"content_rowid='c_ClaveProdServ', tokenize='{FTS_TOKENIZER}', prefix='2 3 4')"
+)
+# Vista de solo lectura del vocabulario del índice, para corregir errores de dedo
+_FTS_VOCAB_SQL = "CREATE VIRTUAL TABLE IF NOT EXISTS clave_prod_serv_vocab USING fts5vocab(clave_prod_serv_fts, 'row')"
+
 
 @with_db
 def create_fts_table(*, db):
-    db.execute(text("""
-        CREATE VIRTUAL TABLE IF NOT EXISTS clave_prod_serv_fts 
-        USING fts5(Combined, c_ClaveProdServ UNINDEXED, content='clave_prod_serv', content_rowid='c_ClaveProdServ');
-    """))
+    """
+    Crea el índice FTS, o lo vuelve a crear si cambió su definición (tokenizador, prefijos).
+
+    Returns:
+        bool: True si el índice quedó vacío y hay que reconstruirlo completo.
+    """
+    db.execute(text(_FTS_VOCAB_SQL))
+    current = db.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'clave_prod_serv_fts'")
+    ).scalar()
+    if current == _FTS_TABLE_SQL:
+        db.commit()
+        return False
+    if current is not None:
+        logger.info("FTS index definition changed, recreating clave_prod_serv_fts")
+        db.execute(text("DROP TABLE clave_prod_serv_fts"))
+    db.execute(text(_FTS_TABLE_SQL))
     db.commit()
+    return True
+
 
+def _validate_xls(path):
+    # Si el SAT responde con una página de error en lugar del archivo, no es un libro OLE2
+    with open(path, "rb") as f:
+        if f.read(len(XLS_MAGIC)) != XLS_MAGIC:
+            raise DownloadError(f"{path} is not an XLS workbook")
 
 
-def download_cfdi_catalog(date_str):
+def discover_latest_catalog():
+    """Fecha del catálogo más reciente publicado por el SAT que aún no está descargado, o None."""
+    return discover_latest(SAT_CATALOG_URL, since=latest_version(CATALOG_DIR))
+
+
+def download_cfdi_catalog(date_str, progress=None):
+    try:
+        parse_catalog_date(date_str)
+    except ValueError:
+        return {"success": False, "reason": "Not a valid date"}
+
     xls_filename = f"catCFDI_V_4_{date_str}.xls"
-    xls_path = f"/app/{xls_filename}"
+    xls_path = f"{CATALOG_DIR}/{xls_filename}"
+    url = f"{SAT_CATALOG_URL}/{xls_filename}"
+    exists = os.path.isfile(xls_path)
 
-    if not os.path.isfile(xls_path):
-        url = f"http://omawww.sat.gob.mx/tramitesyservicios/Paginas/documentos/{xls_filename}"
-        response = requests.get(url)
-        if response.status_code == 404:
-            return {"success": False, "reason": "Not a valid date"}
-        try:
-            response.raise_for_status()
-            with open(xls_path, "wb") as f:
-                f.write(response.content)
-        except Exception as e:
-            logger.error(f"Failed to download Excel file: {e}")
-            return {"success": False, "reason": e}
+    try:
+        result = download_file(url, xls_path, validate=_validate_xls, progress=progress)
+    except NotFound:
+        if exists:
+            logger.warning(f"{url} is gone, keeping the local copy")
+            return {"success": True, "reason": "file already exists"}
+        return {"success": False, "reason": "Not a valid date"}
+    except (DownloadError, requests.RequestException) as e:
+        if exists:
+            logger.warning(f"Could not revalidate {xls_filename}, keeping the local copy: {e}")
+            return {"success": True, "reason": "file already exists"}
+        logger.error(f"Failed to download Excel file: {e}")
+        return {"success": False, "reason": str(e)}
 
-    return {"success": True, "reason": "file already exists"}
+    stat = os.stat(xls_path)
+    register_version(
+        CATALOG_DIR,
+        date_str,
+        xls=xls_path,
+        xls_sha256=result["sha256"] or file_sha256(xls_path),
+        xls_size=stat.st_size,
+        xls_mtime=stat.st_mtime,
+    )
+    if result["status"] == "not_modified":
+        return {"success": True, "reason": "file already exists", **result}
+    return {"success": True, "reason": "downloaded", **result}
 
 
-def remove_accents(text):
-    if not isinstance(text, str):
-        return ''
-    new_text = unicodedata.normalize('NFD', text).encode('ascii', 'ignore').decode('utf-8')
-    new_text = new_text.replace('ñ', '')
-    if text != new_text:
-        return new_text
+SHEET_NAME = "c_ClaveProdServ"
+SHEET_HEADER_ROW = 4
+CHUNK_ROWS = 5000
 
-    return ''
+PARQUET_SCHEMA = pa.schema([
+    ('c_ClaveProdServ', pa.int64()),
+    ('Descripcion', pa.string()),
+    ('Incluir_IVA_trasladado', pa.string()),
+    ('Incluir_IEPS_trasladado', pa.string()),
+    ('Complemento_que_debe_incluir', pa.string()),
+    ('FechaInicioVigencia', pa.timestamp('us')),
+    ('FechaFinVigencia', pa.timestamp('us')),
+    ('Estimulo_Franja_Fronteriza', pa.string()),
+    ('Palabras_similares', pa.string()),
+    ('Combined', pa.string()),
+])
+
+
+def _transform_chunk(df):
+    for column in ('FechaInicioVigencia', 'FechaFinVigencia'):
+        df[column] = pd.to_datetime(df[column], errors='coerce')
+    df['c_ClaveProdServ'] = pd.to_numeric(df['c_ClaveProdServ'], errors='coerce').astype('Int64')
+    for column in ('Descripcion', 'Incluir_IVA_trasladado', 'Incluir_IEPS_trasladado',
+                   'Complemento_que_debe_incluir', 'Estimulo_Franja_Fronteriza', 'Palabras_similares'):
+        df[column] = df[column].astype('string')
+
+    df['Combined'] = searchable_text(df['Descripcion'], df['Palabras_similares'])
+    return pa.Table.from_pandas(df, schema=PARQUET_SCHEMA, preserve_index=False)
 
 
 def transform_to_parquet(date_str):
     xls_filename = f"catCFDI_V_4_{date_str}.xls"
-    xls_path = f"/app/{xls_filename}"
+    xls_path = f"{CATALOG_DIR}/{xls_filename}"
     parquet_filename = f"catalogo_{date_str}.parquet"
-    parquet_path = f"/app/{parquet_filename}"
-
-    excel_data = pd.ExcelFile(xls_path)
-    df = pd.read_excel(excel_data, sheet_name="c_ClaveProdServ", skiprows=4)
-    df.columns = [
-        'c_ClaveProdServ',
-        'Descripcion',
-        'Incluir_IVA_trasladado',
-        'Incluir_IEPS_trasladado',
-        'Complemento_que_debe_incluir',
-        'FechaInicioVigencia',
-        'FechaFinVigencia',
-        'Estimulo_Franja_Fronteriza',
-        'Palabras_similares',
-    ]
-
-    df['FechaInicioVigencia'] = pd.to_datetime(df['FechaInicioVigencia'], errors='coerce')
-    df['FechaFinVigencia'] = pd.to_datetime(df['FechaFinVigencia'], errors='coerce')
-    df['FechaInicioVigencia'] = df['FechaInicioVigencia'].apply(lambda x: x if pd.notna(x) else None)
-    df['FechaFinVigencia'] = df['FechaFinVigencia'].apply(lambda x: x if pd.notna(x) else None)
-
-    df['c_ClaveProdServ'] = pd.to_numeric(df['c_ClaveProdServ'], errors='coerce')
-    df['Combined'] = (
-            df['Descripcion'].fillna('').astype(str) + ' ' +
-            df['Palabras_similares'].fillna('').astype(str) + ' ' +
-            df['Descripcion'].fillna('').apply(remove_accents).astype(str) + ' ' +
-            df['Palabras_similares'].fillna('').apply(remove_accents).astype(str)
-    )
+    parquet_path = f"{CATALOG_DIR}/{parquet_filename}"
 
-    df.to_parquet(parquet_path, index=False)
+    start = time.perf_counter()
+    # La hoja completa se carga en memoria: xlrd no puede leer un .xls por partes, así
+    # que pd.read_excel es el pico de memoria. Solo la transformación y la escritura
+    # van por bloques de CHUNK_ROWS filas, un row group de parquet cada uno
+    phases = {"xls_read": 0.0, "transform": 0.0, "parquet_write": 0.0}
+    df = pd.read_excel(xls_path, sheet_name=SHEET_NAME, skiprows=SHEET_HEADER_ROW)
+    df.columns = CATALOG_COLUMNS[:-1]
+    rows = len(df)
+    phases["xls_read"] = time.perf_counter() - start
+    with replace_atomically(parquet_path) as tmp_path, pq.ParquetWriter(tmp_path, PARQUET_SCHEMA) as writer:
+        for offset in range(0, rows, CHUNK_ROWS):
+            mark = time.perf_counter()
+            table = _transform_chunk(df.iloc[offset:offset + CHUNK_ROWS].copy())
+            phases["transform"] += time.perf_counter() - mark
+            mark = time.perf_counter()
+            writer.write_table(table)
+            phases["parquet_write"] += time.perf_counter() - mark
 
+    elapsed = time.perf_counter() - start
+    for phase, seconds in phases.items():
+        LOADER_PHASE_DURATION.labels(phase=phase).observe(seconds)
+    LOADER_ROWS.labels(table="parquet").set(rows)
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
     logger.info(f"Success: saved as {parquet_filename}")
+    logger.info(
+        f"Transformed {rows} rows in {elapsed:.2f}s ({rows / elapsed if elapsed else 0:.0f} rows/s), "
+        f"peak RSS {peak_rss_mb:.0f} MB"
+    )
     logger.info(f"Represents data from: {date_str}")
     logger.info(f"Pulled on: {datetime.now().isoformat()}")
 
     return parquet_path
 
 
-@with_db
-def load_latest_catalog_to_db(*, db):
-    create_fts_table()
-    files = [f for f in os.listdir("/app") if f.startswith("catalogo_") and f.endswith(".parquet")]
-    if not files:
-        raise FileNotFoundError("No catalog files found")
+def _xls_sha256(date_str, xls_path, entry):
+    # El sha256 del registro sigue siendo válido mientras el tamaño y el mtime del XLS no cambien
+    stat = os.stat(xls_path)
+    if entry.get("xls_sha256") and entry.get("xls_size") == stat.st_size and entry.get("xls_mtime") == stat.st_mtime:
+        return entry["xls_sha256"]
+    sha256 = file_sha256(xls_path)
+    register_version(
+        CATALOG_DIR, date_str, xls=xls_path, xls_sha256=sha256, xls_size=stat.st_size, xls_mtime=stat.st_mtime
+    )
+    return sha256
+
+
+def ensure_parquet(date_str):
+    """Regenera el parquet solo si el contenido del XLS cambió desde la última conversión."""
+    xls_path = f"{CATALOG_DIR}/catCFDI_V_4_{date_str}.xls"
+    parquet_path = f"{CATALOG_DIR}/catalogo_{date_str}.parquet"
+
+    if not os.path.isfile(xls_path):
+        if os.path.isfile(parquet_path):
+            logger.info(f"No XLS for {date_str}, using existing {parquet_path}")
+            register_version(CATALOG_DIR, date_str, parquet=parquet_path)
+            return parquet_path
+        raise FileNotFoundError(f"No XLS or parquet found for {date_str}")
+
+    entry = load_versions(CATALOG_DIR).get(date_str, {})
+    sha256 = _xls_sha256(date_str, xls_path, entry)
+    # parquet_source_sha256: sha256 del XLS con el que se generó el parquet
+    if os.path.isfile(parquet_path) and entry.get("parquet_source_sha256") == sha256:
+        logger.info(f"Parquet for {date_str} is current, skipping XLS transform")
+        return parquet_path
+
+    transform_to_parquet(date_str)
+    register_version(CATALOG_DIR, date_str, parquet=parquet_path, parquet_source_sha256=sha256)
+    return parquet_path
+
+
+def _clean_record(record):
+    clean = {}
+    for key, value in record.items():
+        if value is not None and not isinstance(value, str) and pd.isna(value):
+            value = None
+        elif isinstance(value, pd.Timestamp):
+            value = value.to_pydatetime()
+        clean[key] = value
+    code = clean["c_ClaveProdServ"]
+    if code is not None and not isinstance(code, str):
+        clean["c_ClaveProdServ"] = str(int(code))
+    return clean
 
-    latest_file = max(files, key=str)
-    latest_date = latest_file.split("_")[1].split(".")[0]
 
-    transform_to_parquet(latest_date)
+def _comparable(value):
+    # Las columnas String de SQLite devuelven texto aunque el parquet traiga números
+    if value is None or isinstance(value, datetime):
+        return value
+    return str(value)
 
-    df = pd.read_parquet(f"/app/{latest_file}")
-    records = df.to_dict(orient="records")
 
-    db.query(ClaveProdServ).delete()
-    db.execute(text("DELETE FROM clave_prod_serv_fts"))
-    db.bulk_insert_mappings(ClaveProdServ, records)
+def _fts_entry(record):
+    return {
+        "rowid": int(record["c_ClaveProdServ"]),
+        "Combined": record["Combined"],
+        "c_ClaveProdServ": record["c_ClaveProdServ"],
+    }
 
-    fts_records = [{"Combined": r["Combined"], "c_ClaveProdServ": r["c_ClaveProdServ"]} for r in records if r.get("Combined")]
 
-    for record in fts_records:
-        db.execute(text("INSERT INTO clave_prod_serv_fts (Combined, c_ClaveProdServ) VALUES (:Combined, :c_ClaveProdServ)"), record)
-    db.execute(text("INSERT INTO clave_prod_serv_fts(clave_prod_serv_fts) VALUES('rebuild')"))
+def _apply_catalog_diff(records, *, db):
+    """
+    Aplica solo las filas agregadas, eliminadas o modificadas de c_ClaveProdServ
+    a la tabla y al índice FTS, en lugar de borrar y reinsertar todo.
+    """
+    columns = [column.name for column in ClaveProdServ.__table__.columns]
+    existing = {
+        row.c_ClaveProdServ: dict(row._mapping)
+        for row in db.execute(select(ClaveProdServ.__table__))
+    }
+    incoming = {r["c_ClaveProdServ"]: r for r in records}
+
+    added = [incoming[code] for code in incoming.keys() - existing.keys()]
+    removed = [existing[code] for code in existing.keys() - incoming.keys()]
+    changed_old = []
+    changed_new = []
+    for code in incoming.keys() & existing.keys():
+        if any(_comparable(incoming[code].get(c)) != _comparable(existing[code].get(c)) for c in columns):
+            changed_old.append(existing[code])
+            changed_new.append(incoming[code])
+
+    stale = removed + changed_old
+    fresh = added + changed_new
+
+    # En una tabla FTS5 de contenido externo el 'delete' necesita los valores anteriores
+    if stale:
+        db.execute(
+            text(
+                "INSERT INTO clave_prod_serv_fts(clave_prod_serv_fts, rowid, Combined, c_ClaveProdServ) "
+                "VALUES('delete', :rowid, :Combined, :c_ClaveProdServ)"
+            ),
+            [_fts_entry(r) for r in stale],
+        )
+        db.execute(
+            ClaveProdServ.__table__.delete().where(
+                ClaveProdServ.c_ClaveProdServ.in_([r["c_ClaveProdServ"] for r in stale])
+            )
+        )
+    if fresh:
+        db.bulk_insert_mappings(ClaveProdServ, fresh)
+        db.execute(
+            text(
+                "INSERT INTO clave_prod_serv_fts(rowid, Combined, c_ClaveProdServ) "
+                "VALUES(:rowid, :Combined, :c_ClaveProdServ)"
+            ),
+            [_fts_entry(r) for r in fresh],
+        )
     db.commit()
-    return {"success": True, "date": latest_date}
\ No newline at end of file
+
+    stats = {"added": len(added), "removed": len(removed), "changed": len(changed_new)}
+    logger.info(f"Applied catalog diff: {stats}")
+    return stats
+
+
+def _catalog_records(date_str):
+    parquet_path = ensure_parquet(date_str)
+    with LOADER_PHASE_DURATION.labels(phase="parquet_read").time():
+        df = pd.read_parquet(parquet_path, columns=CATALOG_COLUMNS)
+        # Los parquet anteriores guardaban Combined con el texto duplicado (con y sin acentos)
+        df['Combined'] = searchable_text(df['Descripcion'], df['Palabras_similares'])
+        return [
+            _clean_record(r) for r in df.to_dict(orient="records") if pd.notna(r["c_ClaveProdServ"])
+        ]
+
+
+def _history_versions(date_str):
+    # Las últimas HISTORY_VERSIONS versiones descargadas hasta la que se está cargando
+    until = parse_catalog_date(date_str)
+    versions = sorted(
+        (v for v in load_versions(CATALOG_DIR) if parse_catalog_date(v) <= until), key=parse_catalog_date
+    )
+    return versions[-HISTORY_VERSIONS:]
+
+
+@with_db
+def load_latest_catalog_to_db(diff=False, version="latest", *, db):
+    fts_created = create_fts_table(db=db)
+    # "latest" o una fecha YYYYMMDD del registro de versiones descargadas
+    latest_date = resolve_version(CATALOG_DIR, version)
+    records = _catalog_records(latest_date)
+
+    if diff and not fts_created and db.query(ClaveProdServ).first() is not None:
+        with LOADER_PHASE_DURATION.labels(phase="catalog_diff").time():
+            stats = _apply_catalog_diff(records, db=db)
+        result = {"success": True, "date": latest_date, "mode": "diff", **stats}
+    else:
+        timings = build_fts_index(records, db=db)
+        result = {"success": True, "date": latest_date, "mode": "full", "timings": timings}
+    # Junta clave_prod_serv con classification; la taxonomía ya se cargó antes que el catálogo
+    build_search_table(db=db)
+
+    result["history"] = update_history(
+        _history_versions(latest_date),
+        lambda date_str: records if date_str == latest_date else _catalog_records(date_str),
+        db=db,
+    )
+    return result
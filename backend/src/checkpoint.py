@@ -0,0 +1,127 @@
+"""
+Checkpoint en disco (JSONL de solo anexado) para reanudar la descarga de la taxonomía PyS
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, List, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlCheckpoint:
+    """
+    Guarda cada familia y segmento terminados en cuanto se completan.
+
+    Líneas del archivo:
+        {"kind": "type", "key", "name", "segments": [...]}
+        {"kind": "family", "type", "segment", "key", "name", "classes": [...]}
+        {"kind": "segment", "type", "key", "name", "families": [...]}
+
+    Al reanudar, los segmentos y familias ya presentes no se vuelven a pedir al SAT.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._families: Set[Tuple[str, str, str]] = set()
+        self._segments: Set[Tuple[str, str]] = set()
+        self._recover()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _recover(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for raw_line in f:
+                try:
+                    entry = json.loads(raw_line)
+                except ValueError:
+                    # Línea truncada por una caída a mitad de escritura
+                    break
+                if not raw_line.endswith(b"\n"):
+                    break
+                valid_size += len(raw_line)
+                if entry["kind"] == "family":
+                    self._families.add((entry["type"], entry["segment"], entry["key"]))
+                elif entry["kind"] == "segment":
+                    self._segments.add((entry["type"], entry["key"]))
+        if valid_size < os.path.getsize(self.path):
+            logger.warning(f"Truncating partial line at byte {valid_size} of {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+        logger.info(
+            f"Resuming from {self.path}: {len(self._segments)} segments, {len(self._families)} families done"
+        )
+
+    def _append(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def has_segment(self, type_id: str, segment_id: str) -> bool:
+        return (type_id, segment_id) in self._segments
+
+    def has_family(self, type_id: str, segment_id: str, family_id: str) -> bool:
+        return (type_id, segment_id, family_id) in self._families
+
+    def add_type(self, type_id: str, name: str, segment_ids: List[str]) -> None:
+        self._append({"kind": "type", "key": type_id, "name": name, "segments": segment_ids})
+
+    def add_family(self, type_id: str, segment_id: str, family_data: Dict[str, Any]) -> None:
+        self._append({"kind": "family", "type": type_id, "segment": segment_id, **family_data})
+        with self._lock:
+            self._families.add((type_id, segment_id, family_data["key"]))
+
+    def add_segment(self, type_id: str, segment_id: str, name: str, family_ids: List[str]) -> None:
+        self._append({"kind": "segment", "type": type_id, "key": segment_id, "name": name, "families": family_ids})
+        with self._lock:
+            self._segments.add((type_id, segment_id))
+
+    def assemble(self) -> List[Dict[str, Any]]:
+        """Reconstruye el árbol completo, en el orden del sitio, a partir del checkpoint."""
+        types: Dict[str, Dict[str, Any]] = {}
+        segments: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        families: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+
+        with self._lock:
+            self._file.flush()
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                entry = json.loads(line)
+                kind = entry.pop("kind")
+                if kind == "type":
+                    types[entry["key"]] = entry
+                elif kind == "segment":
+                    segments[(entry.pop("type"), entry["key"])] = entry
+                else:
+                    families[(entry.pop("type"), entry.pop("segment"), entry["key"])] = entry
+
+        result = []
+        for type_id, type_entry in types.items():
+            type_data = {"key": type_id, "name": type_entry["name"], "segments": []}
+            for segment_id in type_entry["segments"]:
+                segment_entry = segments.get((type_id, segment_id))
+                if segment_entry is None:
+                    raise RuntimeError(f"Checkpoint incomplete: segment {type_id}/{segment_id} missing")
+                type_data["segments"].append(
+                    {
+                        "key": segment_id,
+                        "name": segment_entry["name"],
+                        "families": [families[(type_id, segment_id, f)] for f in segment_entry["families"]],
+                    }
+                )
+            result.append(type_data)
+        return result
+
+    def close(self) -> None:
+        self._file.close()
+
+    def discard(self) -> None:
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,214 @@
+"""
+Descarga de archivos grandes por bloques, con reanudación (Range) y GET condicional
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+from src.metrics import DOWNLOAD_BYTES, DOWNLOAD_REQUESTS
+from src.file_lock import replace_atomically
+
+
+logger = logging.getLogger(__name__)
+
+# Bloques chicos: si la conexión se cae a media lectura, urllib3 descarta el bloque incompleto
+DOWNLOAD_CHUNK = 64 * 1024
+# (conexión, lectura entre bloques) en segundos
+DOWNLOAD_TIMEOUT = (10, 60)
+DOWNLOAD_RETRIES = 3
+
+
+class DownloadError(Exception):
+    """La descarga no se pudo completar o el archivo recibido no es válido."""
+
+
+class NotFound(DownloadError):
+    """El servidor respondió 404."""
+
+
+def _meta_path(path: str) -> str:
+    return f"{path}.download.json"
+
+
+def _load_meta(path: str) -> Dict[str, Any]:
+    try:
+        with open(_meta_path(path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_meta(path: str, meta: Dict[str, Any]) -> None:
+    with replace_atomically(_meta_path(path)) as tmp_path, open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def file_sha256(path: str) -> str:
+    """sha256 en hexadecimal, leyendo el archivo por bloques."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _expected_size(response: requests.Response, offset: int) -> Optional[int]:
+    content_range = response.headers.get("Content-Range", "")
+    if response.status_code == 206 and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+    length = response.headers.get("Content-Length")
+    return offset + int(length) if length and length.isdigit() else None
+
+
+def _range_start(response: requests.Response) -> Optional[int]:
+    # Content-Range: bytes 1000-1999/2000
+    unit_range = response.headers.get("Content-Range", "").partition(" ")[2]
+    start = unit_range.partition("-")[0]
+    return int(start) if start.isdigit() else None
+
+
+def download_file(
+    url: str,
+    path: str,
+    validate: Optional[Callable[[str], None]] = None,
+    progress: Optional[Callable[[str, int], None]] = None,
+    session: Optional[requests.Session] = None,
+    retries: int = DOWNLOAD_RETRIES,
+    timeout=DOWNLOAD_TIMEOUT,
+) -> Dict[str, Any]:
+    """
+    Descarga url a path sin cargar el archivo completo en memoria.
+
+    El contenido se escribe por bloques en path.part y solo se renombra a path
+    una vez verificado. Si la transferencia se corta, el siguiente intento sigue
+    donde se quedó con Range/If-Range. Si path ya existe, se revalida con el ETag
+    o Last-Modified guardados en path.download.json y un 304 no descarga nada.
+
+    Args:
+        validate: Recibe la ruta del archivo completo y lanza DownloadError si no es válido.
+        progress: Callback progress(nombre, cantidad) con los bytes recibidos.
+
+    Returns:
+        Dict: status ("downloaded" o "not_modified"), bytes descargados, resumed_from y sha256.
+
+    Raises:
+        NotFound: Si el servidor responde 404.
+        DownloadError: Si el archivo recibido no pasa la verificación.
+        requests.RequestException: Si fallan todos los intentos.
+    """
+    http = session or requests.Session()
+    part_path = f"{path}.part"
+    meta = _load_meta(path)
+
+    for attempt in range(retries + 1):
+        headers = {}
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        partial = meta.get("partial") or {}
+        partial_validator = partial.get("etag") or partial.get("last_modified")
+        if offset and partial_validator and partial.get("url") == url:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = partial_validator
+        else:
+            offset = 0
+        if os.path.isfile(path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            with http.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                DOWNLOAD_REQUESTS.labels(status=response.status_code).inc()
+                if response.status_code == 304:
+                    logger.info(f"{path} is up to date ({url} not modified)")
+                    return {
+                        "status": "not_modified",
+                        "bytes": 0,
+                        "resumed_from": None,
+                        "sha256": meta.get("sha256"),
+                    }
+                if response.status_code == 404:
+                    raise NotFound(f"{url} not found")
+                if response.status_code == 416 or (
+                    response.status_code == 206 and _range_start(response) != offset
+                ):
+                    # El rango pedido ya no corresponde al archivo: empezar de cero
+                    logger.warning(f"Discarding partial download of {url}")
+                    os.remove(part_path)
+                    meta.pop("partial", None)
+                    continue
+                response.raise_for_status()
+
+                if response.status_code == 206:
+                    logger.info(f"Resuming download of {url} at byte {offset}")
+                    mode = "ab"
+                else:
+                    # 200: el servidor no aceptó el rango o el archivo cambió
+                    offset, mode = 0, "wb"
+                expected = _expected_size(response, offset)
+
+                # Validadores del archivo en curso, para poder reanudar tras un corte
+                meta["partial"] = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                }
+                _save_meta(path, meta)
+
+                received = 0
+                with open(part_path, mode) as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK):
+                        f.write(chunk)
+                        received += len(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk))
+                        if progress:
+                            progress("bytes", len(chunk))
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == retries:
+                raise
+            delay = 2**attempt
+            logger.warning(f"Download of {url} interrupted ({e}), retrying in {delay}s")
+            time.sleep(delay)
+            continue
+
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            if attempt == retries:
+                raise DownloadError(f"Incomplete download of {url}: {size} of {expected} bytes")
+            logger.warning(f"Download of {url} ended at {size} of {expected} bytes, retrying")
+            if size > expected:
+                os.remove(part_path)
+            continue
+        break
+    else:
+        raise DownloadError(f"Could not download {url} after {retries + 1} attempts")
+
+    try:
+        if validate:
+            validate(part_path)
+    except DownloadError:
+        os.remove(part_path)
+        meta.pop("partial", None)
+        _save_meta(path, meta)
+        raise
+
+    sha256 = file_sha256(part_path)
+    os.replace(part_path, path)
+    partial = meta.pop("partial", {})
+    meta.update({
+        "url": url,
+        "etag": partial.get("etag"),
+        "last_modified": partial.get("last_modified"),
+        "size": size,
+        "sha256": sha256,
+    })
+    _save_meta(path, meta)
+    logger.info(f"Downloaded {url} to {path} ({size} bytes, sha256 {sha256[:12]})")
+    return {"status": "downloaded", "bytes": received, "resumed_from": offset or None, "sha256": sha256}
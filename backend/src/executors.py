@@ -0,0 +1,83 @@
+"""
+Pools acotados para sacar el trabajo bloqueante del event loop de FastAPI
+"""
+
+import os
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Consultas cortas a SQLite; igual al pool_size del engine de snapshots
+DB_WORKERS = int(os.environ.get("DB_WORKERS", "8"))
+# Descargas y lectura de archivos
+IO_WORKERS = int(os.environ.get("IO_WORKERS", "4"))
+
+db_pool = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+# Construcción de snapshots (pandas + SQLite): CPU pesado, va en otro proceso para no competir por el GIL
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+# Servidor de objetos compartidos con el pool de procesos (eventos de cancelación)
+_manager = None
+
+
+def _init_cpu_worker() -> None:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - LINE %(lineno)d - %(levelname)s - %(message)s",
+    )
+
+
+def _get_cpu_pool() -> ProcessPoolExecutor:
+    global _cpu_pool
+    if _cpu_pool is None:
+        _cpu_pool = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_cpu_worker,
+        )
+    return _cpu_pool
+
+
+def cancel_event():
+    """
+    Event que se le puede pasar a una función de run_cpu para pedirle que se
+    detenga; un threading.Event no sirve porque no cruza al otro proceso.
+    """
+    global _manager
+    if _manager is None:
+        _manager = multiprocessing.get_context("spawn").Manager()
+    return _manager.Event()
+
+
+async def run_db(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(db_pool, partial(func, *args, **kwargs))
+
+
+async def run_io(func: Callable[..., Any], *args, **kwargs) -> Any:
+    return await asyncio.get_running_loop().run_in_executor(io_pool, partial(func, *args, **kwargs))
+
+
+async def run_cpu(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Ejecuta en un proceso aparte; func y sus argumentos deben poder serializarse con pickle.
+    Sus métricas solo aparecen en /metrics en modo multiproceso (PROMETHEUS_MULTIPROC_DIR).
+    """
+    return await asyncio.get_running_loop().run_in_executor(_get_cpu_pool(), partial(func, *args, **kwargs))
+
+
+def shutdown() -> None:
+    global _cpu_pool, _manager
+    db_pool.shutdown(wait=False, cancel_futures=True)
+    io_pool.shutdown(wait=False, cancel_futures=True)
+    if _cpu_pool is not None:
+        _cpu_pool.shutdown(wait=False, cancel_futures=True)
+        _cpu_pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
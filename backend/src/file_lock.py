@@ -0,0 +1,83 @@
+"""
+Locks entre procesos (fcntl.flock) y escritura atómica para los archivos que
+comparten los workers
+"""
+
+import os
+import fcntl
+import logging
+import tempfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class LockBusy(Exception):
+    """Otro proceso (u otro worker) tiene el lock."""
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = False):
+    """
+    Toma un lock exclusivo sobre path mientras dura el bloque.
+
+    El sistema operativo lo libera si el proceso muere, así que no quedan locks
+    huérfanos como con un archivo marcador. El archivo de lock no se borra nunca.
+
+    Args:
+        path: Archivo de lock; se crea si no existe.
+        blocking: Si es False y el lock está tomado, lanza LockBusy en lugar de esperar.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            raise LockBusy(f"{path} is held by another process")
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def is_locked(path: str) -> bool:
+    """True si otro proceso tiene el lock en este momento."""
+    try:
+        with file_lock(path):
+            return False
+    except LockBusy:
+        return True
+
+
+def _umask() -> int:
+    # Solo se puede leer cambiándola; se restaura de inmediato
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextmanager
+def replace_atomically(path: str):
+    """
+    Da una ruta temporal única junto a path; al salir del bloque sin errores la
+    mueve sobre path con os.replace, y si hubo error la borra.
+
+    Con nombres temporales fijos (path.tmp) dos procesos escribiendo a la vez se
+    pisan el archivo a medio escribir o fallan en el os.replace.
+
+    mkstemp crea el archivo con permisos 0600; antes de moverlo se le dan los
+    mismos que tendría un archivo creado con open() (0666 menos la umask).
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, 0o666 & ~_umask())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,85 @@
+"""
+Construcción masiva de la tabla clave_prod_serv y su índice FTS5
+"""
+
+import time
+import sqlite3
+import logging
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, List
+
+from db import ClaveProdServ
+from src.metrics import LOADER_PHASE_DURATION, LOADER_ROWS
+
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "clave_prod_serv_fts"
+
+_COLUMNS = [column.name for column in ClaveProdServ.__table__.columns]
+_INSERT_SQL = (
+    f"INSERT INTO {ClaveProdServ.__tablename__} ({', '.join(_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in _COLUMNS)})"
+)
+
+
+@contextmanager
+def _phase(name: str, timings: Dict[str, float]):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        timings[name] = round(elapsed, 4)
+        LOADER_PHASE_DURATION.labels(phase=f"fts_{name}").observe(elapsed)
+        logger.info(f"FTS build phase '{name}' took {timings[name]:.3f}s")
+
+
+def _to_row(record: Dict[str, Any]) -> tuple:
+    row = []
+    for column in _COLUMNS:
+        value = record.get(column)
+        if isinstance(value, datetime):
+            # Mismo formato que usa el tipo DateTime de SQLAlchemy en SQLite
+            value = value.strftime("%Y-%m-%d %H:%M:%S.%f")
+        row.append(value)
+    return tuple(row)
+
+
+def _populate(conn: sqlite3.Connection, records: List[Dict[str, Any]], timings: Dict[str, float]) -> None:
+    cursor = conn.cursor()
+    with _phase("delete", timings):
+        cursor.execute(f"DELETE FROM {ClaveProdServ.__tablename__}")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('delete-all')")
+    with _phase("insert", timings):
+        cursor.executemany(_INSERT_SQL, (_to_row(r) for r in records))
+    # El índice es de contenido externo: un solo 'rebuild' lo lee completo de clave_prod_serv
+    with _phase("rebuild", timings):
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('rebuild')")
+    with _phase("optimize", timings):
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES('optimize')")
+    conn.commit()
+
+
+def build_fts_index(records: List[Dict[str, Any]], *, db) -> Dict[str, float]:
+    """
+    Reemplaza el contenido de clave_prod_serv y reconstruye su índice FTS5 en la
+    misma base de db, con la conexión sqlite3 de la sesión; pensado para el
+    archivo del snapshot en construcción, que nadie más está leyendo.
+
+    Args:
+        records: Filas ya normalizadas de c_ClaveProdServ.
+        db: Sesión de SQLAlchemy sobre el snapshot en construcción.
+
+    Returns:
+        Dict[str, float]: Segundos empleados en cada fase.
+    """
+    timings = {}
+    db.commit()
+    _populate(db.connection().connection.dbapi_connection, records, timings)
+
+    db.commit()
+    LOADER_ROWS.labels(table="clave_prod_serv").set(len(records))
+    logger.info(f"FTS index built for {len(records)} rows: {timings}")
+    return timings
@@ -6,84 +6,183 @@ import os
 import sys
 import time
 import logging
-from typing import Dict, List, Any
-
-from src._scraper import obtain_types
-from src._scraper import obtain_segments
-from src._scraper import obtain_families
-from src._scraper import obtain_classes
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Any, Optional
+
+from src._scraper import PYS_URL
+from src._scraper import PySSession
+from src._scraper import RateLimiter
+from src.checkpoint import CrawlCheckpoint
+from src.file_lock import file_lock
+from src.file_lock import is_locked
 from src._exporter import export_to_json
 from src._exporter import export_to_xml
 
 
 logger = logging.getLogger(__name__)
 
+# Número de sesiones paralelas contra el SAT y límite global de solicitudes por segundo
+PYS_WORKERS = int(os.environ.get("PYS_WORKERS", "4"))
+PYS_REQUESTS_PER_SECOND = float(os.environ.get("PYS_REQUESTS_PER_SECOND", "8"))
 
-def generate_pys_data(silent=False) -> List[Dict[str, Any]]:
-    """
-    Genera toda la estructura de datos del catálogo PyS.
 
-    Args:
-        silent: Si es True, no muestra mensajes de progreso.
+def _crawl_segment(
+    get_session: Callable[[], PySSession],
+    type_id: str,
+    segment_id: str,
+    segment_name: str,
+    silent: bool,
+    checkpoint: Optional[CrawlCheckpoint] = None,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> Optional[Dict[str, Any]]:
+    """
+    Recorre las familias y clases de un segmento con la sesión del worker actual.
 
-    Returns:
-        List[Dict[str, Any]]: Lista de tipos con su estructura jerárquica completa.
+    Con checkpoint, cada familia se escribe a disco al terminarla y no se conserva
+    en memoria; en ese caso devuelve None.
     """
-    types_list = []
+    if checkpoint and checkpoint.has_segment(type_id, segment_id):
+        return None
 
+    session = get_session()
+    # Cada segmento parte de un formulario limpio para que el __VIEWSTATE sea coherente
+    session.send_get()
+    session.obtain_segments(type_id)
+
+    segment_data = {"key": segment_id, "name": segment_name, "families": []}
     if not silent:
-        logger.info("Obteniendo tipos...")
+        logger.info(f"  Segmento: {segment_id} - {segment_name}")
 
-    types = obtain_types()
-    for type_id, type_name in types.items():
-        if type_id == "0":
+    families = session.obtain_families(type_id, segment_id)
+    for family_id, family_name in families.items():
+        if family_id == "0":
             continue
-        type_data = {"key": type_id, "name": type_name, "segments": []}
+        if checkpoint and checkpoint.has_family(type_id, segment_id, family_id):
+            continue
+        family_data = {"key": family_id, "name": family_name, "classes": []}
 
         if not silent:
-            logger.info(f"Tipo: {type_id} - {type_name}")
+            logger.info(f"    Familia: {family_id} - {family_name}")
 
-        segments = obtain_segments(type_id)
-        for segment_id, segment_name in segments.items():
-            if segment_id == "0":
+        classes = session.obtain_classes(type_id, segment_id, family_id)
+        for class_id, class_name in classes.items():
+            if class_id == "0":
                 continue
-            segment_data = {"key": segment_id, "name": segment_name, "families": []}
+            class_data = {"key": class_id, "name": class_name}
+            family_data["classes"].append(class_data)
 
             if not silent:
-                logger.info(f"  Segmento: {segment_id} - {segment_name}")
+                logger.info(f"      Clase: {class_id} - {class_name}")
+
+        if checkpoint:
+            checkpoint.add_family(type_id, segment_id, family_data)
+        else:
+            segment_data["families"].append(family_data)
+        if progress:
+            progress("families", 1)
+            progress("classes", len(family_data["classes"]))
+
+    if progress:
+        progress("segments", 1)
+    if checkpoint:
+        family_ids = [family_id for family_id in families if family_id != "0"]
+        checkpoint.add_segment(type_id, segment_id, segment_name, family_ids)
+        return None
+    return segment_data
+
+
+def generate_pys_data(
+    silent=False,
+    workers: int = PYS_WORKERS,
+    requests_per_second: Optional[float] = PYS_REQUESTS_PER_SECOND,
+    url: str = PYS_URL,
+    checkpoint: Optional[CrawlCheckpoint] = None,
+    progress: Optional[Callable[[str, int], None]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Genera toda la estructura de datos del catálogo PyS.
 
-            families = obtain_families(type_id, segment_id)
-            for family_id, family_name in families.items():
-                if family_id == "0":
-                    continue
-                family_data = {"key": family_id, "name": family_name, "classes": []}
+    Los segmentos se recorren en paralelo, cada worker con su propia sesión y
+    estado de formulario; el resultado conserva el orden del sitio.
 
-                if not silent:
-                    logger.info(f"    Familia: {family_id} - {family_name}")
+    Args:
+        silent: Si es True, no muestra mensajes de progreso.
+        workers: Número de sesiones paralelas.
+        requests_per_second: Límite global de solicitudes por segundo (None o 0 sin límite).
+        url: URL de catPyS.aspx (permite apuntar a un servidor local de pruebas).
+        checkpoint: Si se indica, los subárboles terminados se guardan en él, se
+            omiten los ya presentes y el resultado se arma desde el checkpoint.
+        progress: Callback progress(nombre, cantidad) por cada segmento, familia y
+            clases recorridas; puede lanzar una excepción para detener el recorrido.
+
+    Returns:
+        List[Dict[str, Any]]: Lista de tipos con su estructura jerárquica completa.
+    """
+    rate_limiter = RateLimiter(requests_per_second)
+    worker_state = threading.local()
+
+    def get_session() -> PySSession:
+        if not hasattr(worker_state, "session"):
+            worker_state.session = PySSession(url, rate_limiter=rate_limiter)
+        return worker_state.session
 
-                classes = obtain_classes(type_id, segment_id, family_id)
-                for class_id, class_name in classes.items():
-                    if class_id == "0":
-                        continue
-                    class_data = {"key": class_id, "name": class_name}
-                    family_data["classes"].append(class_data)
+    main_session = PySSession(url, rate_limiter=rate_limiter)
+    types_list = []
 
-                    if not silent:
-                        logger.info(f"      Clase: {class_id} - {class_name}")
+    if not silent:
+        logger.info("Obteniendo tipos...")
 
-                segment_data["families"].append(family_data)
-            type_data["segments"].append(segment_data)
-        types_list.append(type_data)
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="pys") as pool:
+        pending = []
+        try:
+            types = main_session.obtain_types()
+            for type_id, type_name in types.items():
+                if type_id == "0":
+                    continue
+                type_data = {"key": type_id, "name": type_name, "segments": []}
 
+                if not silent:
+                    logger.info(f"Tipo: {type_id} - {type_name}")
+
+                segments = main_session.obtain_segments(type_id)
+                if checkpoint:
+                    segment_ids = [segment_id for segment_id in segments if segment_id != "0"]
+                    checkpoint.add_type(type_id, type_name, segment_ids)
+                futures = [
+                    pool.submit(
+                        _crawl_segment, get_session, type_id, segment_id, segment_name, silent, checkpoint, progress
+                    )
+                    for segment_id, segment_name in segments.items()
+                    if segment_id != "0"
+                ]
+                pending.append((type_data, futures))
+                types_list.append(type_data)
+
+            # La primera falla (o cancelación) de cualquier segmento detiene todo el recorrido
+            done, _ = wait([future for _, futures in pending for future in futures], return_when=FIRST_EXCEPTION)
+            for future in done:
+                future.result()
+            for type_data, futures in pending:
+                type_data["segments"] = [future.result() for future in futures]
+        except BaseException:
+            # Los segmentos en cola no se inician; al salir del with solo se esperan los que ya corren
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    if checkpoint:
+        return checkpoint.assemble()
     return types_list
 
 
+PULL_LOCK = "output.json.lock"
+
+
 def is_pull_locked():
-    lock_file = "output.json.lock"
     output_file = "output.json"
 
-    if os.path.exists(lock_file):
-        return {"locked": True, "reason": "lock file exists"}
+    if is_locked(PULL_LOCK):
+        return {"locked": True, "reason": "A pull is already running in another worker"}
 
     if not os.path.exists(output_file):
         return {"locked": False, "reason": "output.json does not exist"}
@@ -97,19 +196,28 @@ def is_pull_locked():
     return {"locked": False, "reason": "output.json is older than 1 week"}
 
 
-def pull_json(forced=False):
+def pull_json(forced=False, progress: Optional[Callable[[str, int], None]] = None):
+    """
+    Descarga la taxonomía completa a output.json.
+
+    El gestor de trabajos (src/jobs.py) evita dos descargas en el mismo proceso;
+    el lock sobre output.json.lock las excluye entre workers, que comparten el
+    checkpoint. Si otro worker ya está descargando lanza LockBusy.
+    Salvo con forced=True se respeta la antigüedad mínima de output.json.
+    """
     locked_status = is_pull_locked()
     if locked_status["locked"] and not forced:
-        logger.info("Lock is active, not pulling anything")
+        logger.info(f"Not pulling anything: {locked_status['reason']}")
         return
     output_file = "output.json"
-    logger.info("Starting pull_json operation")
-    open("output.json.lock", "w").close()
-    try:
-        data = generate_pys_data()
-        result = export_to_json(data, output_file)
-        return result
-    finally:
-        if os.path.exists("output.json.lock"):
-            os.remove("output.json.lock")
-        logger.info("pull_json operation completed")
+    with file_lock(PULL_LOCK):
+        logger.info("Starting pull_json operation")
+        checkpoint = CrawlCheckpoint(f"{output_file}.checkpoint.jsonl")
+        try:
+            data = generate_pys_data(checkpoint=checkpoint, progress=progress)
+            result = export_to_json(data, output_file)
+            checkpoint.discard()
+            return result
+        finally:
+            checkpoint.close()
+            logger.info("pull_json operation completed")
@@ -0,0 +1,139 @@
+"""
+Caché en proceso de respuestas JSON ya codificadas, con ETag y GET condicional
+"""
+
+import os
+import gzip
+import json
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from email.utils import formatdate
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import Response
+
+from src.responses import dumps
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class EncodedResponse:
+    """Cuerpo JSON codificado una sola vez, con sus variantes comprimidas."""
+
+    def __init__(self, body: bytes, mtime: float):
+        self.body = body
+        self.mtime = mtime
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self.last_modified = formatdate(mtime, usegmt=True)
+        self.variants = {"gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.variants["br"] = brotli.compress(body, quality=5)
+
+
+_cache: Dict[str, Tuple[Tuple[int, int], EncodedResponse]] = {}
+_lock = threading.Lock()
+
+
+def cached_file_response(path: str, build: Callable[[Any, float], Any]) -> EncodedResponse:
+    """
+    Devuelve la respuesta codificada para un archivo JSON, reconstruyéndola solo
+    cuando cambian su mtime o su tamaño.
+
+    Args:
+        path: Archivo JSON de origen.
+        build: Recibe los datos del archivo y su mtime y devuelve el objeto a enviar.
+
+    Raises:
+        FileNotFoundError: Si el archivo no existe.
+        json.JSONDecodeError: Si el archivo no es JSON válido.
+    """
+    stat = os.stat(path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached = _cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with _lock:
+        cached = _cache.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        body = dumps(build(data, stat.st_mtime))
+        entry = EncodedResponse(body, stat.st_mtime)
+        _cache[path] = (key, entry)
+        logger.info(f"Cached encoded response for {path} ({len(body)} bytes, variants: {sorted(entry.variants)})")
+        return entry
+
+
+def _accepted_encodings(header: str) -> Dict[str, float]:
+    accepted = {}
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def _not_modified(request: Request, entry: EncodedResponse) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or entry.etag in tags
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return int(entry.mtime) <= since.timestamp()
+    return False
+
+
+def conditional_response(request: Request, entry: EncodedResponse, media_type: str = "application/json") -> Response:
+    """Responde 304 si el cliente ya tiene la versión, o la variante comprimida que acepte."""
+    headers = {
+        "ETag": entry.etag,
+        "Last-Modified": entry.last_modified,
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if _not_modified(request, entry):
+        return Response(status_code=304, headers=headers)
+
+    accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+    for coding in ("br", "gzip"):
+        if coding in entry.variants and accepted.get(coding, accepted.get("*", 0.0)) > 0:
+            headers["Content-Encoding"] = coding
+            return Response(content=entry.variants[coding], media_type=media_type, headers=headers)
+    return Response(content=entry.body, media_type=media_type, headers=headers)
+
+
+def file_timestamp(mtime: float) -> str:
+    return datetime.fromtimestamp(mtime).isoformat()
+
+
+def clear_cache(path: Optional[str] = None) -> None:
+    with _lock:
+        if path is None:
+            _cache.clear()
+        else:
+            _cache.pop(path, None)
@@ -0,0 +1,200 @@
+"""
+Trabajos en segundo plano (descargas y recargas) con progreso, cancelación y
+una sola ejecución simultánea por tipo de trabajo
+"""
+
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.metrics import JOB_PHASE_DURATION, JOBS_FINISHED
+
+logger = logging.getLogger(__name__)
+
+# Trabajos terminados que se conservan para consultar su resultado
+MAX_FINISHED_JOBS = 50
+
+ACTIVE_STATES = ("queued", "running", "cancelling")
+
+
+class JobCancelled(Exception):
+    """Se lanza dentro del trabajo cuando alguien pidió cancelarlo."""
+
+
+class JobFailed(Exception):
+    """Falla esperada de un trabajo; el mensaje se reporta tal cual en /jobs."""
+
+
+class Job:
+    def __init__(self, job_type: str, params: Dict[str, Any]):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.params = params
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.phases: Dict[str, float] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.now()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self._cancel = threading.Event()
+        self._cancel_callbacks: List[Callable[[], Any]] = []
+        self._irreversible = False
+        self._lock = threading.Lock()
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATES
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self) -> None:
+        """Punto de cancelación; seguro de llamar desde hilos de trabajo."""
+        if self._cancel.is_set() and not self._irreversible:
+            raise JobCancelled(f"Job {self.id} cancelled")
+
+    def on_cancel(self, callback: Callable[[], Any]) -> None:
+        """
+        Registra callback() para avisar de la cancelación a trabajo que no corre en
+        este proceso y no puede llamar a check_cancelled (p. ej. en run_cpu).
+        """
+        self._cancel_callbacks.append(callback)
+        if self.cancelled:
+            callback()
+
+    def point_of_no_return(self) -> None:
+        """
+        Marca que el trabajo ya tiene efectos que no se deshacen (p. ej. publicó un
+        snapshot); desde aquí se ignoran las cancelaciones y termina como succeeded.
+        """
+        self._irreversible = True
+
+    def report(self, **values: Any) -> None:
+        with self._lock:
+            self.progress.update(values)
+
+    def increment(self, name: str, amount: int = 1) -> None:
+        self.check_cancelled()
+        with self._lock:
+            self.progress[name] = self.progress.get(name, 0) + amount
+
+    @contextmanager
+    def phase(self, name: str):
+        self.check_cancelled()
+        self.report(phase=name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = round(elapsed, 3)
+            JOB_PHASE_DURATION.labels(job_type=self.type, phase=name).observe(elapsed)
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            progress = dict(self.progress)
+        return {
+            "id": self.id,
+            "type": self.type,
+            "params": self.params,
+            "status": self.status,
+            "progress": progress,
+            "phases": dict(self.phases),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class JobManager:
+    def __init__(self):
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+    def active(self, job_type: str) -> Optional[Job]:
+        return next((job for job in self._jobs.values() if job.type == job_type and job.active), None)
+
+    def submit(
+        self, job_type: str, func: Callable[..., Awaitable[Any]], **params: Any
+    ) -> Tuple[Job, bool]:
+        """
+        Lanza func(job, **params) como tarea del event loop.
+
+        Returns:
+            (job, created): si ya hay un trabajo activo del mismo tipo se devuelve
+            ese con created=False en lugar de lanzar otro.
+        """
+        running = self.active(job_type)
+        if running:
+            return running, False
+
+        job = Job(job_type, params)
+        self._jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job, func, params))
+        self._prune()
+        logger.info(f"Job {job.id} ({job_type}) submitted with {params}")
+        return job, True
+
+    async def _run(self, job: Job, func: Callable[..., Awaitable[Any]], params: Dict[str, Any]) -> None:
+        if job.status == "queued":
+            job.status = "running"
+        job.started_at = datetime.now()
+        try:
+            # Si func terminó, sus efectos ya están hechos aunque llegara una cancelación
+            result = await func(job, **params)
+            job.result = result
+            job.status = "succeeded"
+        except JobCancelled:
+            job.status = "cancelled"
+        except JobFailed as e:
+            job.status = "failed"
+            job.error = str(e)
+        except Exception as e:
+            logger.exception(f"Job {job.id} ({job.type}) failed")
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        finally:
+            job.finished_at = datetime.now()
+            job.report(phase=None)
+            JOBS_FINISHED.labels(job_type=job.type, status=job.status).inc()
+            logger.info(f"Job {job.id} ({job.type}) {job.status}")
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[Job]:
+        return list(reversed(self._jobs.values()))
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Pide la cancelación. El trabajo se detiene en su siguiente punto de control
+        y sigue contando como activo hasta entonces, así nunca corren dos a la vez.
+        Pasado su point_of_no_return el trabajo ya no se puede cancelar.
+        """
+        job = self._jobs.get(job_id)
+        if job is None or not job.active or job._irreversible:
+            return job
+        job._cancel.set()
+        job.status = "cancelling"
+        for callback in job._cancel_callbacks:
+            callback()
+        return job
+
+    def _prune(self) -> None:
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+
+jobs = JobManager()
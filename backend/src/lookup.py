@@ -0,0 +1,96 @@
+"""
+Consultas en lote: muchas claves c_ClaveProdServ y búsquedas de texto por petición
+"""
+
+import logging
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import bindparam
+from sqlalchemy import text
+from session import with_db
+from db import ClaveProdServ, Classification
+from src.search import search_clave_prod_serv
+from src.catalog_history import day_number
+
+
+logger = logging.getLogger(__name__)
+
+# Claves por sentencia IN (...); queda muy por debajo del límite de variables de SQLite
+LOOKUP_CHUNK = 500
+
+PRODUCT_COLUMNS = [column.name for column in ClaveProdServ.__table__.columns if column.name != "Combined"]
+CLASSIFICATION_COLUMNS = [column.name for column in Classification.__table__.columns]
+
+_LOOKUP_SQL = text(f"""
+    SELECT {", ".join(f"p.{column}" for column in PRODUCT_COLUMNS)},
+           {", ".join(f"c.{column}" for column in CLASSIFICATION_COLUMNS)}
+    FROM clave_prod_serv p
+    LEFT JOIN classification c ON c.Clase_num = CAST(p.c_ClaveProdServ AS INTEGER) / 100
+    WHERE p.c_ClaveProdServ IN :codes
+""").bindparams(bindparam("codes", expanding=True))
+
+# La fila del historial vigente en la fecha pedida; los intervalos de una clave no se traslapan.
+# El índice (c_ClaveProdServ, valid_from, valid_to) resuelve clave y fecha sin leer las filas.
+_LOOKUP_AS_OF_SQL = text(f"""
+    SELECT {", ".join(f"p.{column}" for column in PRODUCT_COLUMNS)},
+           {", ".join(f"c.{column}" for column in CLASSIFICATION_COLUMNS)}
+    FROM clave_prod_serv_history p
+    LEFT JOIN classification c ON c.Clase_num = CAST(p.c_ClaveProdServ AS INTEGER) / 100
+    WHERE p.c_ClaveProdServ IN :codes AND p.valid_from <= :day AND p.valid_to >= :day
+""").bindparams(bindparam("codes", expanding=True))
+
+
+def normalize_code(code) -> Optional[str]:
+    """'01010101', ' 1010101 ' y 1010101 son la misma clave; None si no es numérica."""
+    code = str(code).strip()
+    if not code.isdigit():
+        return None
+    return str(int(code))
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+@with_db
+def lookup_codes(codes: List, as_of: Optional[date] = None, *, db) -> List[Dict]:
+    """
+    Busca cada clave con una consulta por cada LOOKUP_CHUNK claves distintas.
+    Con as_of se devuelve la versión de cada clave vigente en esa fecha.
+
+    Returns:
+        List[Dict]: Un resultado por clave, en el mismo orden en que se pidieron.
+    """
+    keys = [normalize_code(code) for code in codes]
+    found = {}
+    for chunk in _chunks(list(dict.fromkeys(key for key in keys if key)), LOOKUP_CHUNK):
+        if as_of is None:
+            rows = db.execute(_LOOKUP_SQL, {"codes": chunk})
+        else:
+            rows = db.execute(_LOOKUP_AS_OF_SQL, {"codes": chunk, "day": day_number(as_of)})
+        for row in rows:
+            product = dict(zip(PRODUCT_COLUMNS, row[:len(PRODUCT_COLUMNS)]))
+            classification = dict(zip(CLASSIFICATION_COLUMNS, row[len(PRODUCT_COLUMNS):]))
+            if classification["Clase_num"] is None:
+                classification = None
+            found[product["c_ClaveProdServ"]] = (product, classification)
+
+    results = []
+    for code, key in zip(codes, keys):
+        product, classification = found.get(key, (None, None))
+        results.append({
+            "code": code,
+            "found": product is not None,
+            "product": product,
+            "classification": classification,
+        })
+    return results
+
+
+@with_db
+def lookup_queries(queries: List[str], limit: int = 5, as_of: Optional[date] = None, *, db) -> List[Dict]:
+    """Todas las búsquedas en la misma sesión; las repetidas se resuelven una sola vez."""
+    results = {q: search_clave_prod_serv(q, limit=limit, as_of=as_of, db=db) for q in dict.fromkeys(queries)}
+    return [{"q": q, "results": results[q]} for q in queries]
@@ -0,0 +1,120 @@
+"""
+Métricas de Prometheus (prometheus_client)
+
+Cada proceso lleva sus propios valores. Con varios workers de uvicorn, o para
+incluir lo que mide el pool de procesos de executors.run_cpu, define
+PROMETHEUS_MULTIPROC_DIR con un directorio vacío al arrancar: cada proceso
+escribe ahí sus valores y /metrics los suma.
+"""
+
+import os
+
+from prometheus_client import REGISTRY
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram
+from prometheus_client import generate_latest, multiprocess
+
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+# Segundos; de consultas de un milisegundo a cargas completas del catálogo
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PHASE_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds",
+    "Latencia de las peticiones HTTP por endpoint (hasta enviar los encabezados)",
+    ["method", "path", "status"],
+    buckets=DEFAULT_BUCKETS,
+)
+FTS_QUERY_DURATION = Histogram(
+    "fts_query_duration_seconds",
+    "Duración de las consultas al índice FTS5",
+    ["kind"],
+    buckets=DEFAULT_BUCKETS,
+)
+FTS_QUERY_ERRORS = Counter(
+    "fts_query_errors_total",
+    "Consultas FTS5 que fallaron",
+    ["kind"],
+)
+SCRAPER_REQUESTS = Counter(
+    "scraper_requests_total",
+    "Peticiones al sitio PyS por método y resultado (ok, retry, error)",
+    ["method", "outcome"],
+)
+SCRAPER_REQUEST_DURATION = Histogram(
+    "scraper_request_duration_seconds",
+    "Latencia de las peticiones al sitio PyS, incluyendo el parseo",
+    ["method"],
+    buckets=DEFAULT_BUCKETS,
+)
+DOWNLOAD_REQUESTS = Counter(
+    "download_requests_total",
+    "Peticiones de descarga de archivos del SAT por código de respuesta",
+    ["status"],
+)
+DOWNLOAD_BYTES = Counter(
+    "download_bytes_total",
+    "Bytes descargados de archivos del SAT",
+)
+LOADER_PHASE_DURATION = Histogram(
+    "loader_phase_duration_seconds",
+    "Duración de cada fase de la carga del catálogo y la taxonomía",
+    ["phase"],
+    buckets=PHASE_BUCKETS,
+)
+# La carga corre en el pool de procesos; con varios procesos vale la del más reciente
+LOADER_ROWS = Gauge(
+    "loader_rows",
+    "Filas procesadas en la última carga, por tabla o archivo",
+    ["table"],
+    multiprocess_mode="mostrecent",
+)
+JOB_PHASE_DURATION = Histogram(
+    "job_phase_duration_seconds",
+    "Duración de las fases de los trabajos en segundo plano",
+    ["job_type", "phase"],
+    buckets=PHASE_BUCKETS,
+)
+JOBS_FINISHED = Counter(
+    "jobs_finished_total",
+    "Trabajos en segundo plano terminados por estado",
+    ["job_type", "status"],
+)
+RESULT_CACHE_HITS = Counter(
+    "result_cache_hits_total",
+    "Aciertos de las cachés de resultados",
+    ["cache"],
+)
+RESULT_CACHE_MISSES = Counter(
+    "result_cache_misses_total",
+    "Fallos de las cachés de resultados",
+    ["cache"],
+)
+RESULT_CACHE_EVICTIONS = Counter(
+    "result_cache_evictions_total",
+    "Resultados desalojados por tamaño",
+    ["cache"],
+)
+# Cada worker tiene su propia caché; se suman las de los procesos vivos
+RESULT_CACHE_ENTRIES = Gauge(
+    "result_cache_entries",
+    "Resultados guardados en las cachés",
+    ["cache"],
+    multiprocess_mode="livesum",
+)
+
+
+def render_metrics() -> bytes:
+    """Texto para /metrics; en modo multiproceso junta lo de todos los procesos."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def mark_process_dead() -> None:
+    """Al apagar un worker: sus gauges 'live' dejan de contar en la suma."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
+
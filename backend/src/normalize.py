@@ -0,0 +1,52 @@
+"""
+Normalización de texto compartida por el índice FTS y las búsquedas: minúsculas,
+sin acentos y separado en palabras de la misma forma en ambos lados
+"""
+
+import re
+import unicodedata
+from functools import lru_cache
+
+
+# Tokenizador del índice FTS5; remove_diacritics 2 también quita acentos en
+# caracteres compuestos, así que el índice y la consulta pliegan igual
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+class _FoldTable(dict):
+    """
+    Tabla para str.translate: cada carácter se descompone con NFD una sola vez
+    y se queda sin sus marcas diacríticas.
+    """
+
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        decomposed = unicodedata.normalize("NFD", char)
+        folded = "".join(c for c in decomposed if not unicodedata.combining(c))
+        self[codepoint] = codepoint if folded == char else folded
+        return self[codepoint]
+
+
+_FOLD_TABLE = _FoldTable()
+
+
+@lru_cache(maxsize=8192)
+def fold(text: str) -> str:
+    """'Crédito Niño' -> 'credito nino'"""
+    return text.lower().translate(_FOLD_TABLE)
+
+
+def fold_series(series):
+    """fold vectorizado para una columna de pandas; los nulos quedan como ''."""
+    return series.fillna("").astype(str).str.lower().str.translate(_FOLD_TABLE)
+
+
+def tokenize(text: str):
+    return _TOKEN_RE.findall(fold(text))
+
+
+def searchable_text(descripcion, palabras_similares):
+    """Columna Combined: descripción y palabras similares una sola vez, ya plegadas."""
+    return (fold_series(descripcion) + " " + fold_series(palabras_similares)).str.strip()
@@ -0,0 +1,34 @@
+"""
+Codificación JSON rápida (orjson si está instalado) y formato columnar para respuestas grandes
+"""
+
+import json
+from typing import Any, Dict, Iterable, List, Sequence
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """JSON compacto en UTF-8; las tuplas se codifican como arreglos."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def records(fields: Sequence[str], rows: Iterable[Sequence[Any]]) -> List[Dict[str, Any]]:
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def columnar(fields: Sequence[str], rows: Iterable[Sequence[Any]]) -> Dict[str, Any]:
+    """Los nombres de los campos una sola vez y luego cada fila como arreglo."""
+    return {"fields": list(fields), "rows": [tuple(row) for row in rows]}
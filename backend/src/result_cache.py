@@ -0,0 +1,79 @@
+"""
+Caché LRU con expiración para resultados de búsqueda repetidos
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from src.metrics import RESULT_CACHE_ENTRIES, RESULT_CACHE_EVICTIONS, RESULT_CACHE_HITS, RESULT_CACHE_MISSES
+
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "2048"))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "600"))
+
+
+class ResultCache:
+    """
+    Guarda hasta maxsize resultados durante ttl segundos. Las llaves deben incluir
+    la versión del catálogo; clear() además libera todo al cambiar de snapshot.
+    """
+
+    def __init__(self, name: str, maxsize: int = SEARCH_CACHE_SIZE, ttl: float = SEARCH_CACHE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    RESULT_CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
+                self.misses += 1
+                RESULT_CACHE_MISSES.labels(cache=self.name).inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            RESULT_CACHE_HITS.labels(cache=self.name).inc()
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                RESULT_CACHE_EVICTIONS.labels(cache=self.name).inc()
+            RESULT_CACHE_ENTRIES.labels(cache=self.name).set(len(self._entries))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            RESULT_CACHE_ENTRIES.labels(cache=self.name).set(0)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else None,
+            }
+
+
+search_cache = ResultCache("search")
@@ -0,0 +1,158 @@
+import logging
+
+from sqlalchemy import text
+from session import with_db
+from src.normalize import tokenize
+from src.catalog_history import day_number
+from src.responses import records
+from src.metrics import FTS_QUERY_DURATION, FTS_QUERY_ERRORS, LOADER_PHASE_DURATION, LOADER_ROWS
+
+
+logger = logging.getLogger(__name__)
+
+# Peso extra (en unidades de bm25) para los resultados que contienen la frase completa.
+# bm25() devuelve valores negativos (menor es mejor), por eso se resta.
+PHRASE_BOOST = 1000.0
+
+SEARCH_COLUMNS = [
+    "c_ClaveProdServ",
+    "Descripcion",
+    "Palabras_similares",
+    "tipo_num",
+    "Tipo",
+    "Div_num",
+    "Division",
+    "Grupo_num",
+    "Grupo",
+    "Clase_num",
+    "Clase",
+]
+
+_SEARCH_SQL = text("""
+    SELECT s.c_ClaveProdServ, s.Descripcion, s.Palabras_similares,
+           s.tipo_num, s.Tipo, s.Div_num, s.Division, s.Grupo_num, s.Grupo, s.Clase_num, s.Clase
+    FROM (
+        SELECT rowid AS hit_rowid,
+               bm25(clave_prod_serv_fts) - CASE
+                   WHEN rowid IN (
+                       SELECT rowid FROM clave_prod_serv_fts WHERE clave_prod_serv_fts MATCH :phrase
+                   ) THEN :phrase_boost ELSE 0
+               END AS score
+        FROM clave_prod_serv_fts
+        WHERE clave_prod_serv_fts MATCH :match
+    ) AS hits
+    JOIN clave_prod_serv_search s ON s.clave_num = hits.hit_rowid
+    WHERE s.Clase_num IS NOT NULL
+    ORDER BY hits.score, hits.hit_rowid
+    LIMIT :limit OFFSET :offset
+""")
+
+# Misma búsqueda sobre el historial: solo las filas cuyo intervalo de vigencia contiene
+# la fecha pedida. El FTS da los candidatos y cada uno se filtra por su fila del historial
+# (búsqueda por id); un índice de intervalos no ayuda porque la fecha casi no descarta filas.
+_SEARCH_AS_OF_SQL = text("""
+    SELECT h.c_ClaveProdServ, h.Descripcion, h.Palabras_similares,
+           c.tipo_num, c.Tipo, c.Div_num, c.Division, c.Grupo_num, c.Grupo, c.Clase_num, c.Clase
+    FROM (
+        SELECT rowid AS hit_rowid,
+               bm25(clave_prod_serv_history_fts) - CASE
+                   WHEN rowid IN (
+                       SELECT rowid FROM clave_prod_serv_history_fts WHERE clave_prod_serv_history_fts MATCH :phrase
+                   ) THEN :phrase_boost ELSE 0
+               END AS score
+        FROM clave_prod_serv_history_fts
+        WHERE clave_prod_serv_history_fts MATCH :match
+    ) AS hits
+    JOIN clave_prod_serv_history h ON h.id = hits.hit_rowid
+    JOIN classification c ON c.Clase_num = CAST(h.c_ClaveProdServ AS INTEGER) / 100
+    WHERE h.valid_from <= :day AND h.valid_to >= :day
+    ORDER BY hits.score, CAST(h.c_ClaveProdServ AS INTEGER)
+    LIMIT :limit OFFSET :offset
+""")
+
+
+# Tabla desnormalizada: cada producto ya unido con su Tipo/Division/Grupo/Clase.
+# clave_num es INTEGER PRIMARY KEY (alias del rowid), igual al rowid del índice FTS.
+_BUILD_SEARCH_TABLE_SQL = text("""
+    INSERT INTO clave_prod_serv_search (
+        clave_num, c_ClaveProdServ, Descripcion, Palabras_similares,
+        tipo_num, Tipo, Div_num, Division, Grupo_num, Grupo, Clase_num, Clase
+    )
+    SELECT CAST(p.c_ClaveProdServ AS INTEGER), p.c_ClaveProdServ, p.Descripcion, p.Palabras_similares,
+           c.tipo_num, c.Tipo, c.Div_num, c.Division, c.Grupo_num, c.Grupo, c.Clase_num, c.Clase
+    FROM clave_prod_serv p
+    LEFT JOIN classification c ON c.Clase_num = CAST(p.c_ClaveProdServ AS INTEGER) / 100
+""")
+
+
+@with_db
+def build_search_table(*, db):
+    with LOADER_PHASE_DURATION.labels(phase="search_table").time():
+        db.execute(text("DELETE FROM clave_prod_serv_search"))
+        db.execute(_BUILD_SEARCH_TABLE_SQL)
+        db.commit()
+    count = db.execute(text("SELECT COUNT(*) FROM clave_prod_serv_search")).scalar()
+    LOADER_ROWS.labels(table="clave_prod_serv_search").set(count)
+    logger.info(f"Built clave_prod_serv_search with {count} rows")
+    return count
+
+
+def tokenize_query(q):
+    # Mismo plegado que la columna Combined: "Crédito" y "credito" son la misma palabra
+    return tokenize(q)
+
+
+def compile_match_query(q):
+    """
+    Compila la búsqueda en una sola expresión FTS5: la frase completa OR cada palabra.
+
+    Returns:
+        (match, phrase): expresión para MATCH y la frase usada para el boost,
+        o (None, None) si la búsqueda no tiene palabras.
+    """
+    words = list(dict.fromkeys(tokenize_query(q)))
+    if not words:
+        return None, None
+
+    phrase = '"' + " ".join(tokenize_query(q)) + '"'
+    terms = [phrase] + [f'"{word}"' for word in words if f'"{word}"' != phrase]
+    return " OR ".join(terms), phrase
+
+
+@with_db
+def search_rows(q, limit=50, offset=0, as_of=None, *, db):
+    """
+    Resultados como tuplas en el orden de SEARCH_COLUMNS, sin armar un dict por fila.
+
+    Con as_of (date) se busca en el historial del catálogo las claves vigentes en esa fecha.
+    """
+    match, phrase = compile_match_query(q)
+    if match is None:
+        return []
+
+    kind = "search" if as_of is None else "search_as_of"
+    try:
+        with FTS_QUERY_DURATION.labels(kind=kind).time():
+            rows = db.execute(
+                _SEARCH_SQL if as_of is None else _SEARCH_AS_OF_SQL,
+                {
+                    "match": match,
+                    "phrase": phrase,
+                    "phrase_boost": PHRASE_BOOST,
+                    "limit": limit,
+                    "offset": offset,
+                    "day": day_number(as_of),
+                },
+            ).fetchall()
+    except Exception as e:
+        FTS_QUERY_ERRORS.labels(kind=kind).inc()
+        logger.error(f"Search failed for {q!r}: {e}")
+        db.rollback()
+        return []
+
+    return [tuple(row) for row in rows]
+
+
+@with_db
+def search_clave_prod_serv(q, limit=50, offset=0, as_of=None, *, db):
+    return records(SEARCH_COLUMNS, search_rows(q, limit=limit, offset=offset, as_of=as_of, db=db))
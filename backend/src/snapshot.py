@@ -0,0 +1,182 @@
+"""
+Construcción de snapshots SQLite versionados (tablas + índice FTS5) de solo lectura
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy import text
+from sqlalchemy.orm import sessionmaker
+
+from db import Base
+from src.taxonomy import load_flatten_data
+from src.catalogo_pull import load_latest_catalog_to_db
+from src.catalog_history import copy_history
+from src.metrics import LOADER_PHASE_DURATION
+from src.file_lock import file_lock, replace_atomically
+from src.jobs import JobCancelled
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR", "/app/data")
+CURRENT_POINTER = os.path.join(SNAPSHOT_DIR, "current.json")
+# Un solo worker a la vez construye snapshots (comparten el sidecar de la taxonomía y los registros del catálogo)
+BUILD_LOCK = os.path.join(SNAPSHOT_DIR, "build.lock")
+# Los workers cambian de snapshot al sondear current.json (main.SNAPSHOT_POLL_SECONDS); mientras tanto
+# siguen sirviendo el que ya fue reemplazado, así que no se borra hasta que pase este margen
+PRUNE_GRACE_SECONDS = int(os.environ.get("SNAPSHOT_PRUNE_GRACE_SECONDS", "60"))
+
+
+def current_snapshot() -> Optional[str]:
+    """Devuelve la ruta del snapshot vigente, o None si aún no se ha construido."""
+    if not os.path.isfile(CURRENT_POINTER):
+        return None
+    try:
+        with open(CURRENT_POINTER, "r", encoding="utf-8") as f:
+            path = json.load(f)["path"]
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        logger.warning(f"Ignoring unreadable snapshot pointer {CURRENT_POINTER}: {e}")
+        return None
+    return path if os.path.isfile(path) else None
+
+
+def snapshot_catalog_date(path: str) -> str:
+    """Fecha (YYYYMMDD) del catálogo con el que se construyó el snapshot: catalog_<fecha>_<built_at>.sqlite"""
+    return os.path.basename(path).split("_")[1]
+
+
+def _set_current(path: str, catalog_date: str) -> None:
+    with replace_atomically(CURRENT_POINTER) as tmp_pointer, open(tmp_pointer, "w", encoding="utf-8") as f:
+        json.dump({"path": path, "catalog_date": catalog_date}, f)
+
+
+def prune_snapshots(keep) -> None:
+    """
+    Borra los snapshots que no están en keep (el vigente y el anterior como respaldo)
+    y que dejaron de ser el vigente hace más de PRUNE_GRACE_SECONDS.
+
+    Un snapshot deja de ser el vigente cuando se publica el siguiente; su mtime es
+    el momento en que se terminó de escribir, justo antes de publicarse.
+    """
+    keep = {os.path.abspath(path) for path in keep if path}
+    snapshots = []
+    for name in os.listdir(SNAPSHOT_DIR):
+        if name.startswith("catalog_") and name.endswith(".sqlite"):
+            path = os.path.abspath(os.path.join(SNAPSHOT_DIR, name))
+            try:
+                snapshots.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                # Otro worker lo acaba de borrar
+                continue
+    snapshots.sort()
+    now = time.time()
+    for (_, path), (replaced_at, _) in zip(snapshots, snapshots[1:]):
+        if path in keep or now - replaced_at < PRUNE_GRACE_SECONDS:
+            continue
+        try:
+            # En POSIX los lectores que aún lo tengan abierto siguen leyendo el inode
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        logger.info(f"Pruned snapshot {path}")
+
+
+def build_snapshot(diff: bool = False, taxonomy_file: str = "output.json", version: str = "latest", cancel=None) -> str:
+    """
+    Construye un nuevo snapshot y lo publica como el vigente.
+
+    Args:
+        diff: Si es True, parte de una copia del snapshot vigente y aplica solo
+            los cambios del catálogo en lugar de cargarlo completo.
+        taxonomy_file: JSON con la taxonomía PyS.
+        version: Fecha YYYYMMDD del catálogo a cargar, o "latest".
+        cancel: Event (executors.cancel_event) que se revisa entre fases; si se
+            activa, el build se descarta antes de publicarse.
+
+    Returns:
+        str: Ruta del snapshot construido.
+
+    Raises:
+        LockBusy: Si otro worker está construyendo un snapshot.
+        JobCancelled: Si se activó cancel.
+    """
+    with file_lock(BUILD_LOCK):
+        return _build_snapshot(diff, taxonomy_file, version, cancel)
+
+
+def ensure_snapshot() -> str:
+    """
+    Snapshot vigente, construyéndolo si no existe. Pensado para el arranque: los
+    workers que arrancan sin snapshot esperan al que lo está construyendo y usan
+    el suyo en lugar de construir uno cada uno.
+    """
+    with file_lock(BUILD_LOCK, blocking=True):
+        return current_snapshot() or _build_snapshot(False, "output.json", "latest")
+
+
+def _check_cancelled(cancel) -> None:
+    if cancel is not None and cancel.is_set():
+        raise JobCancelled("Snapshot build cancelled")
+
+
+def _build_snapshot(diff: bool, taxonomy_file: str, version: str, cancel=None) -> str:
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    built_at = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    tmp_path = os.path.join(SNAPSHOT_DIR, f"building_{built_at}.sqlite")
+
+    previous = current_snapshot()
+    try:
+        result = _build_into(tmp_path, previous, diff, taxonomy_file, version, cancel)
+        # Última oportunidad: después de publicar current.json ya no se puede deshacer
+        _check_cancelled(cancel)
+    except BaseException:
+        # Un build a medias no sirve para nada; con cada fallo quedaría otro archivo del tamaño del catálogo
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    path = os.path.join(SNAPSHOT_DIR, f"catalog_{result['date']}_{built_at}.sqlite")
+    os.replace(tmp_path, path)
+    _set_current(path, result["date"])
+    logger.info(f"Snapshot {path} built ({result['mode']} load)")
+    return path
+
+
+def _build_into(tmp_path: str, previous: Optional[str], diff: bool, taxonomy_file: str, version: str, cancel):
+    if diff and previous:
+        shutil.copyfile(previous, tmp_path)
+
+    build_engine = create_engine(f"sqlite:///{tmp_path}")
+    try:
+        Base.metadata.create_all(bind=build_engine)
+        with sessionmaker(autocommit=False, autoflush=False, bind=build_engine)() as db:
+            db.execute(text("DELETE FROM classification"))
+            db.commit()
+            if previous and not diff:
+                # El historial de versiones anteriores no cambia; solo se le agregan las nuevas
+                copy_history(previous, db=db)
+            _check_cancelled(cancel)
+            load_flatten_data(taxonomy_file, db=db)
+            _check_cancelled(cancel)
+            result = load_latest_catalog_to_db(diff=diff, version=version, db=db)
+            _check_cancelled(cancel)
+            with LOADER_PHASE_DURATION.labels(phase="analyze").time():
+                db.execute(text("ANALYZE"))
+                db.commit()
+        with LOADER_PHASE_DURATION.labels(phase="vacuum").time(), build_engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+    finally:
+        build_engine.dispose()
+    return result
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    print(build_snapshot())
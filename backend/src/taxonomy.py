@@ -1,37 +1,145 @@
+import os
 import json
+import logging
+import threading
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from db import Classification
 from session import with_db
+from src._exporter import flatten_classes, flat_classes_path, source_signature, write_flat_classes
+from src.responses import columnar as to_columnar
+from src.metrics import LOADER_PHASE_DURATION, LOADER_ROWS
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+
+logger = logging.getLogger(__name__)
+
+# Nombre de la lista de hijos en cada nivel del árbol: Tipo -> Segmento -> Familia -> Clase
+CHILD_KEYS = ["segments", "families", "classes"]
+CHILD_FIELDS = ["key", "name", "children_count"]
+
+# Mismo orden que las tuplas de flatten_classes
+CLASSIFICATION_ROW_COLUMNS = ["tipo_num", "Tipo", "Div_num", "Division", "Grupo_num", "Grupo", "Clase_num", "Clase"]
+TAXONOMY_BATCH = 5000
+_INSERT_CLASSIFICATION_SQL = (
+    f"INSERT INTO {Classification.__tablename__} ({', '.join(CLASSIFICATION_ROW_COLUMNS)}) "
+    f"VALUES ({', '.join('?' for _ in CLASSIFICATION_ROW_COLUMNS)})"
+)
+
+
+def _iter_tree(input_file: str) -> Iterator[Dict[str, Any]]:
+    # Con ijson se lee un Tipo a la vez; sin él, el árbol completo
+    with open(input_file, "rb") as file:
+        if ijson is not None:
+            yield from ijson.items(file, "item")
+        else:
+            yield from json.load(file)
+
+
+def _read_flat_classes(path: str) -> Iterator[Tuple]:
+    with open(path, "r", encoding="utf-8") as file:
+        next(file)
+        for line in file:
+            yield tuple(json.loads(line))
+
+
+def _flat_classes_current(input_file: str) -> bool:
+    path = flat_classes_path(input_file)
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.loads(file.readline()) == source_signature(input_file)
+    except (OSError, ValueError):
+        return False
+
+
+def iter_classification_rows(input_file: str = "output.json") -> Iterator[Tuple]:
+    """
+    Clases de input_file como tuplas en el orden de CLASSIFICATION_ROW_COLUMNS.
+
+    Lee el archivo aplanado que escribe export_to_json; si no existe o es de otra
+    versión de input_file, lo vuelve a generar recorriendo el árbol.
+    """
+    if not _flat_classes_current(input_file):
+        try:
+            write_flat_classes(input_file, flatten_classes(_iter_tree(input_file)))
+        except OSError as e:
+            logger.warning(f"Could not write flattened classes for {input_file}: {e}")
+            yield from flatten_classes(_iter_tree(input_file))
+            return
+    yield from _read_flat_classes(flat_classes_path(input_file))
 
 
 @with_db
 def load_flatten_data(input_file="output.json", *, db):
-    with open(input_file, "r", encoding="utf-8") as file:
-        data = json.load(file)
-
-    entries = []
-    for segmento in data:
-        tipo_num = segmento["key"]
-        tipo = segmento["name"]
-        for familia in segmento.get("segments", []):
-            div_num = familia["key"]
-            division = familia["name"]
-            for grupo in familia.get("families", []):
-                grupo_num = grupo["key"]
-                grupo_name = grupo["name"]
-                for clase in grupo.get("classes", []):
-                    clase_num = clase["key"]
-                    clase_name = clase["name"]
-                    entries.append(
-                        Classification(
-                            tipo_num=tipo_num,
-                            Tipo=tipo,
-                            Div_num=div_num,
-                            Division=division,
-                            Grupo_num=grupo_num,
-                            Grupo=grupo_name,
-                            Clase_num=clase_num,
-                            Clase=clase_name,
-                        )
-                    )
-    db.bulk_save_objects(entries)
-    db.commit()
+    # Sin objetos del ORM: tuplas en lotes de TAXONOMY_BATCH con executemany
+    conn = db.connection()
+    rows = iter_classification_rows(input_file)
+    count = 0
+    with LOADER_PHASE_DURATION.labels(phase="taxonomy_insert").time():
+        while True:
+            batch = list(islice(rows, TAXONOMY_BATCH))
+            if not batch:
+                break
+            conn.exec_driver_sql(_INSERT_CLASSIFICATION_SQL, batch)
+            count += len(batch)
+        db.commit()
+    LOADER_ROWS.labels(table="classification").set(count)
+
+
+class TaxonomyIndex:
+    """Índice en memoria del árbol PyS: ruta de claves -> hijos directos."""
+
+    def __init__(self, data: List[Dict[str, Any]]):
+        self.nodes: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._add((), None, data, 0)
+
+    def _add(self, path: Tuple[str, ...], name: Optional[str], children: List[Dict[str, Any]], depth: int) -> None:
+        child_key = CHILD_KEYS[depth] if depth < len(CHILD_KEYS) else None
+        summaries = []
+        for child in children:
+            grandchildren = child.get(child_key, []) if child_key else []
+            summaries.append({"key": child["key"], "name": child["name"], "children_count": len(grandchildren)})
+            if child_key:
+                self._add(path + (child["key"],), child["name"], grandchildren, depth + 1)
+        self.nodes[path] = {"name": name, "children": summaries}
+
+    def children(
+        self, path: Tuple[str, ...], limit: int, offset: int, columnar: bool = False
+    ) -> Optional[Dict[str, Any]]:
+        node = self.nodes.get(path)
+        if node is None:
+            return None
+        children = node["children"][offset : offset + limit]
+        if columnar:
+            children = to_columnar(CHILD_FIELDS, ([c[f] for f in CHILD_FIELDS] for c in children))
+        return {
+            "path": list(path),
+            "name": node["name"],
+            "total": len(node["children"]),
+            "limit": limit,
+            "offset": offset,
+            "children": children,
+        }
+
+
+_index_cache: Dict[str, Tuple[Tuple[int, int], TaxonomyIndex]] = {}
+_index_lock = threading.Lock()
+
+
+def get_taxonomy_index(input_file="output.json") -> TaxonomyIndex:
+    """Construye el índice una vez por versión (mtime y tamaño) del archivo."""
+    stat = os.stat(input_file)
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _index_lock:
+        cached = _index_cache.get(input_file)
+        if cached and cached[0] == key:
+            return cached[1]
+        with open(input_file, "r", encoding="utf-8") as file:
+            index = TaxonomyIndex(json.load(file))
+        _index_cache[input_file] = (key, index)
+        logger.info(f"Built taxonomy index for {input_file} with {len(index.nodes)} nodes")
+        return index